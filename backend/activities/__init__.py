@@ -1,11 +1,16 @@
 # Export all activities for easy import
 from . import twilio_activities
 from . import database_activities
+from . import db_writer
 from . import circle_activities
+from . import pin_activities
+from . import errors
 
 __all__ = [
     'twilio_activities',
     'database_activities',
+    'db_writer',
     'circle_activities',
     'pin_activities',
+    'errors',
 ]
\ No newline at end of file
@@ -1,14 +1,64 @@
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from temporalio import activity
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import logging
+from config import settings
 from services.circle_service import circle_service
+from services.balance_batcher import balance_batcher
+from activities.errors import TransferDeniedError, InvalidTokenError
+from cache import address_cache, balance_cache
+from utils import singleflight
+from models.database import AsyncSessionLocal, IdempotencyKey, User
+from sqlalchemy import select, or_
+from sqlalchemy.dialects.postgresql import insert
 import asyncio
+import uuid
 
 logger = logging.getLogger(__name__)
 
+# Circle IDs that never change once discovered, kept to skip repeat lookups
+_walletset_cache: Dict[str, str] = {}  # user_id -> wallet set id
+_token_id_cache: Dict[str, str] = {}  # chain/token -> Circle token id
+
+USDC_TOKEN_KEY = "ARC-TESTNET-USDC"
+
+
+async def _idempotency_key(step: str) -> str:
+    """
+    Get the Circle idempotency key for a workflow step
+    
+    The key is stored before calling Circle, so a retried activity sends the
+    same key and Circle returns the original result instead of acting twice.
+    Keys are scoped to the run: payment workflow IDs repeat for identical
+    payments, and a later run must not replay an earlier transfer.
+    init_db prunes keys older than IDEMPOTENCY_KEY_RETENTION.
+    """
+    info = activity.info()
+    stmt = (
+        insert(IdempotencyKey)
+        .values(workflow_id=f"{info.workflow_id}/{info.workflow_run_id}", step=step, key=str(uuid.uuid4()))
+        .on_conflict_do_update(
+            index_elements=[IdempotencyKey.workflow_id, IdempotencyKey.step],
+            set_={"key": IdempotencyKey.key}
+        )
+        .returning(IdempotencyKey.key)
+    )
+    
+    async with AsyncSessionLocal() as db:
+        key = await db.scalar(stmt)
+        await db.commit()
+    
+    return key
+
+
+def _find_usdc_token_id(balance_response: Dict[str, Any]) -> Optional[str]:
+    """Pick the USDC token id out of a wallet balances response"""
+    for token_balance in balance_response['data']['tokenBalances']:
+        token = token_balance['token']
+        if 'USDC' in token['symbol']:
+            _token_id_cache[USDC_TOKEN_KEY] = token['id']
+            return token['id']
+    return None
+
 
 @activity.defn
 async def create_circle_wallet(user_id: str) -> Dict[str, str]:
@@ -16,8 +66,34 @@ async def create_circle_wallet(user_id: str) -> Dict[str, str]:
     logger.info(f"Creating Circle wallet for user: {user_id}")
     
     try:
-        result = circle_service.create_user_wallet(user_id)
+        # Reuse the wallet set from an earlier attempt so retries skip that call
+        wallet_set_id = _walletset_cache.get(user_id)
+        if wallet_set_id is None:
+            wallet_set_response = await circle_service.create_wallet_set(
+                f"ArcAgent-{user_id}",
+                idempotency_key=await _idempotency_key("create_wallet_set")
+            )
+            wallet_set_id = wallet_set_response['data']['walletSet']['id']
+            _walletset_cache[user_id] = wallet_set_id
+        
+        result = await circle_service.create_user_wallet(
+            user_id,
+            wallet_set_id=wallet_set_id,
+            idempotency_key=await _idempotency_key("create_wallet")
+        )
         logger.info(f"Created wallet: {result['wallet_id']}, address: {result['wallet_address']}")
+        
+        # Look up the USDC token id once here so transfers don't have to
+        usdc_token_id = _token_id_cache.get(USDC_TOKEN_KEY)
+        if usdc_token_id is None:
+            try:
+                usdc_token_id = _find_usdc_token_id(
+                    await balance_batcher.get_wallet_balance(result['wallet_id'])
+                )
+            except Exception as e:
+                logger.warning(f"Could not look up USDC token id: {str(e)}")
+        
+        result["usdc_token_id"] = usdc_token_id
         return result
     except Exception as e:
         logger.error(f"Failed to create Circle wallet: {str(e)}")
@@ -29,8 +105,16 @@ async def get_wallet_balance(wallet_id: str) -> float:
     """Get wallet USDC balance"""
     logger.info(f"Getting balance for wallet: {wallet_id}")
     
+    cached = await balance_cache.get_cached_balance(wallet_id)
+    if cached is not None:
+        logger.info(f"Wallet {wallet_id} balance (cached): {cached}")
+        return cached
+    
     try:
-        balance_response = circle_service.get_wallet_balance(wallet_id)
+        balance_response = await singleflight.do(
+            f"bal:{wallet_id}",
+            lambda: balance_batcher.get_wallet_balance(wallet_id)
+        )
         token_balances = balance_response['data']['tokenBalances']
         
         logger.info(f"Token balances response: {token_balances}")
@@ -41,15 +125,19 @@ async def get_wallet_balance(wallet_id: str) -> float:
             
             # Match USDC or USDC-TESTNET
             if 'USDC' in symbol:
+                _token_id_cache[USDC_TOKEN_KEY] = token['id']
+                
                 # Parse amount properly - Circle returns string
                 amount_str = token_balance['amount']
                 amount = float(amount_str) if amount_str else 0.0
                 
                 logger.info(f"Wallet {wallet_id} balance: {amount} {symbol} (raw: {amount_str})")
+                await balance_cache.cache_balance(wallet_id, amount)
                 return amount
         
         logger.warning(f"No USDC balance found for wallet {wallet_id}")
         logger.info(f"Available tokens: {[tb['token']['symbol'] for tb in token_balances]}")
+        await balance_cache.cache_balance(wallet_id, 0.0)
         return 0.0
     except Exception as e:
         logger.error(f"Failed to get wallet balance: {str(e)}")
@@ -58,30 +146,30 @@ async def get_wallet_balance(wallet_id: str) -> float:
 
 
 @activity.defn
-async def initiate_transfer(from_wallet_id: str, to_address: str, amount: float) -> Dict[str, Any]:
-    """Initiate transfer via Circle"""
+async def initiate_transfer(
+    from_wallet_id: str,
+    to_address: str,
+    amount: float,
+    token_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """Initiate transfer via Circle (token_id is the sender's saved USDC token id, if known)"""
     logger.info(f"Initiating transfer: {from_wallet_id} -> {to_address}: ${amount}")
     
     try:
-        from config import settings
-        
-        # Get token ID from wallet balance
-        balance_response = circle_service.get_wallet_balance(from_wallet_id)
-        token_balances = balance_response['data']['tokenBalances']
+        if not token_id:
+            token_id = _token_id_cache.get(USDC_TOKEN_KEY)
         
-        token_id = None
-        for token_balance in token_balances:
-            token = token_balance['token']
-            if 'USDC' in token['symbol']:
-                token_id = token['id']
+        if not token_id:
+            # Get token ID from wallet balance
+            token_id = _find_usdc_token_id(await balance_batcher.get_wallet_balance(from_wallet_id))
+            if token_id:
                 logger.info(f"Found USDC token ID: {token_id}")
-                break
         
         if not token_id:
             # Fallback to config if available
             token_id = settings.CIRCLE_USDC_TOKEN_ID
             if not token_id:
-                raise Exception("USDC token not found in wallet")
+                raise InvalidTokenError("USDC token not found in wallet")
         
         logger.info(f"Using token ID: {token_id}")
         
@@ -89,11 +177,13 @@ async def initiate_transfer(from_wallet_id: str, to_address: str, amount: float)
         amount_str = str(amount)
         
         # Create transfer transaction
-        transfer_response = circle_service.create_transaction_transfer(
+        transfer_response = await circle_service.create_transaction_transfer(
             wallet_id=from_wallet_id,
             token_id=token_id,
             destination_address=to_address,
-            amount=amount_str
+            amount=amount_str,
+            ref_id=activity.info().workflow_id,
+            idempotency_key=await _idempotency_key("transfer")
         )
         
         transaction_id = transfer_response['data']['id']
@@ -101,6 +191,9 @@ async def initiate_transfer(from_wallet_id: str, to_address: str, amount: float)
         
         logger.info(f"Transfer initiated: {transaction_id}, status: {status}")
         
+        # Balance is about to change, don't serve the stale value
+        await balance_cache.invalidate_balance(from_wallet_id)
+        
         return {
             "transfer_id": transaction_id,
             "status": status
@@ -113,21 +206,32 @@ async def initiate_transfer(from_wallet_id: str, to_address: str, amount: float)
 
 @activity.defn
 async def check_transfer_status(transfer_id: str) -> Dict[str, Any]:
-    """Check transfer status and wait for tx_hash"""
+    """Check transfer status and wait for tx_hash (fallback when no webhook arrives)"""
     logger.info(f"Checking transfer status: {transfer_id}")
     
     try:
-        max_attempts = 60
+        max_wait_seconds = 180
+        waited = 0.0
         attempt = 0
         
-        while attempt < max_attempts:
-            transaction_response = circle_service.get_transaction(transfer_id)
+        # The webhook usually lands first and cancels this activity during the wait
+        activity.heartbeat(attempt)
+        await asyncio.sleep(settings.CIRCLE_TRANSFER_POLL_DELAY_SECONDS)
+        
+        while waited < max_wait_seconds:
+            # Heartbeat so the workflow can cancel polling once the webhook lands
+            activity.heartbeat(attempt)
+            
+            transaction_response = await singleflight.do(
+                f"tx:{transfer_id}",
+                lambda: circle_service.get_transaction(transfer_id)
+            )
             transaction = transaction_response['data']['transaction']
             
             status = transaction['state']
             tx_hash = transaction.get('txHash', '')
             
-            logger.info(f"Transfer {transfer_id} status: {status}, tx_hash: {tx_hash} (attempt {attempt + 1}/{max_attempts})")
+            logger.info(f"Transfer {transfer_id} status: {status}, tx_hash: {tx_hash} (attempt {attempt + 1})")
             
             # If we have a tx_hash, return immediately
             if tx_hash and tx_hash.startswith('0x'):
@@ -149,14 +253,16 @@ async def check_transfer_status(transfer_id: str) -> Dict[str, Any]:
             
             # Check if transaction failed
             if status in ["FAILED", "DENIED"]:
-                raise Exception(f"Transfer failed with status: {status}")
+                raise TransferDeniedError(f"Transfer failed with status: {status}")
             
-            # Wait before next attempt
-            await asyncio.sleep(3)
+            # Back off exponentially (0.5s, 1s, 2s, ... capped at 10s)
+            delay = min(10.0, 0.5 * 2 ** attempt)
+            await asyncio.sleep(delay)
+            waited += delay
             attempt += 1
         
         # If we exhausted attempts without tx_hash
-        logger.error(f"No tx_hash found after {max_attempts} attempts for transfer {transfer_id}")
+        logger.error(f"No tx_hash found after {attempt} attempts for transfer {transfer_id}")
         raise Exception("Transaction timeout: tx_hash not available")
         
     except Exception as e:
@@ -174,38 +280,30 @@ async def resolve_recipient_address(recipient_identifier: str) -> str:
         logger.info(f"Recipient is already a wallet address: {recipient_identifier}")
         return recipient_identifier
     
-    # Check if it's a phone number - look up in database
-    if recipient_identifier.startswith('+') or recipient_identifier.replace(' ', '').isdigit():
-        from models.database import SessionLocal, User
-        
-        db = SessionLocal()
-        try:
-            # Clean phone number
-            clean_phone = recipient_identifier.strip()
-            if not clean_phone.startswith('+'):
-                clean_phone = f"+{clean_phone}"
-            
-            user = db.query(User).filter(User.whatsapp_number == clean_phone).first()
-            
-            if user and user.circle_wallet_address:
-                logger.info(f"Found user wallet: {user.circle_wallet_address}")
-                return user.circle_wallet_address
-            else:
-                raise Exception(f"User not found or not registered: {recipient_identifier}")
-        finally:
-            db.close()
+    # Phone numbers are matched in +E.164 form; anything else is tried as a user ID
+    lookup_key = recipient_identifier
+    is_phone = recipient_identifier.startswith('+') or recipient_identifier.replace(' ', '').isdigit()
+    if is_phone:
+        lookup_key = recipient_identifier.strip()
+        if not lookup_key.startswith('+'):
+            lookup_key = f"+{lookup_key}"
     
-    # Try to find by user ID or name (you can extend this)
-    from models.database import SessionLocal, User
+    cached_address = address_cache.get_cached_address(lookup_key)
+    if cached_address is not None:
+        return cached_address
     
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.id == recipient_identifier).first()
-        
-        if user and user.circle_wallet_address:
-            logger.info(f"Found user wallet by ID: {user.circle_wallet_address}")
-            return user.circle_wallet_address
-        else:
-            raise Exception(f"Recipient not found: {recipient_identifier}")
-    finally:
-        db.close()
\ No newline at end of file
+    async with AsyncSessionLocal() as db:
+        wallet_address = await db.scalar(
+            select(User.circle_wallet_address)
+            .where(or_(User.whatsapp_number == lookup_key, User.id == lookup_key))
+            .limit(1)
+        )
+    
+    if not wallet_address:
+        if is_phone:
+            raise Exception(f"User not found or not registered: {recipient_identifier}")
+        raise Exception(f"Recipient not found: {recipient_identifier}")
+    
+    logger.info(f"Found user wallet: {wallet_address}")
+    address_cache.cache_address(lookup_key, wallet_address)
+    return wallet_address
@@ -1,5 +1,11 @@
 from temporalio import activity
-from models.database import User, Transaction, Message, SessionLocal
+from models.database import User, Transaction, Message, AsyncSessionLocal, async_engine
+from sqlalchemy import select, update, case, bindparam, DateTime
+from sqlalchemy.dialects.postgresql import insert
+from cache import address_cache, user_cache
+from activities import db_writer
+from utils.security import generate_secure_token
+from utils.batch_queue import BatchQueue
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 import logging
@@ -8,6 +14,97 @@ import uuid
 
 logger = logging.getLogger(__name__)
 
+# Statements are built once at import; each call only binds its values
+_SELECT_USER_BY_PHONE = select(User).where(User.whatsapp_number == bindparam("p_phone"))
+
+_VERIFY_USER_CODE = (
+    update(User)
+    .where(
+        User.whatsapp_number == bindparam("p_phone"),
+        # Already verified users pass and keep their nonce
+        (User.is_verified == True) | (
+            (User.verification_code == bindparam("p_code")) &
+            (User.verification_code_expires > bindparam("p_now", type_=DateTime))
+        )
+    )
+    .values(
+        is_verified=True,
+        nonce=case((User.is_verified == True, User.nonce), else_=bindparam("p_nonce"))
+    )
+    .returning(User.id)
+    .execution_options(synchronize_session=False)
+)
+
+_AUTO_VERIFY_USER = (
+    update(User)
+    .where(User.whatsapp_number == bindparam("p_phone"))
+    .values(is_verified=True, nonce=bindparam("p_nonce"))
+    .returning(User.id)
+    .execution_options(synchronize_session=False)
+)
+
+# Message log writes are queued and flushed in batches by a background task
+MESSAGE_FLUSH_INTERVAL = 0.05  # seconds
+MESSAGE_FLUSH_BATCH_SIZE = 500
+
+# Batches at least this large are written with COPY instead of INSERT
+MESSAGE_COPY_THRESHOLD = 32
+MESSAGE_COPY_COLUMNS = [
+    "id", "user_id", "direction", "message_body", "message_sid", "intent", "workflow_id", "created_at"
+]
+
+
+# Multi-row INSERT; a Twilio retry with an already-logged message_sid is skipped
+# instead of failing the whole batch
+_INSERT_MESSAGES = (
+    insert(Message)
+    .on_conflict_do_nothing(index_elements=[Message.message_sid])
+)
+
+
+async def _copy_messages(batch: list) -> None:
+    """Write a batch with PostgreSQL COPY on the raw asyncpg connection (no per-row parse/plan)"""
+    records = [
+        (uuid.UUID(m["id"]), *(m[column] for column in MESSAGE_COPY_COLUMNS[1:]))
+        for m in batch
+    ]
+    async with async_engine.connect() as conn:
+        raw_connection = await conn.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            Message.__tablename__,
+            records=records,
+            columns=MESSAGE_COPY_COLUMNS
+        )
+
+
+async def _write_messages(batch: list) -> None:
+    """Insert a batch of messages in one transaction"""
+    if len(batch) >= MESSAGE_COPY_THRESHOLD:
+        try:
+            await _copy_messages(batch)
+            logger.info(f"Copied {len(batch)} logged messages")
+            return
+        except Exception as e:
+            # COPY can't skip duplicates (Twilio retries); fall back to INSERT ... ON CONFLICT
+            logger.warning(f"COPY of {len(batch)} logged messages failed, inserting instead: {str(e)}")
+    
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(_INSERT_MESSAGES, batch)
+            await db.commit()
+        logger.info(f"Flushed {len(batch)} logged messages")
+    except Exception as e:
+        logger.error(f"Failed to flush {len(batch)} logged messages: {str(e)}")
+
+
+# Drained by a background task started on the first logged message
+_message_log = BatchQueue(_write_messages, MESSAGE_FLUSH_BATCH_SIZE, MESSAGE_FLUSH_INTERVAL)
+
+
+async def flush_message_log() -> None:
+    """Write any queued messages and stop the flusher (called on worker shutdown)"""
+    await _message_log.close()
+
 
 @activity.defn
 async def create_user(phone_number: str) -> Dict[str, Any]:
@@ -20,18 +117,17 @@ async def create_user(phone_number: str) -> Dict[str, Any]:
     Returns:
         User data dict
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         # Check if user exists
-        existing_user = db.query(User).filter(User.whatsapp_number == phone_number).first()
+        existing_user = await db.scalar(_SELECT_USER_BY_PHONE, {"p_phone": phone_number})
         if existing_user:
             logger.info(f"User already exists: {phone_number}")
             # Generate new verification code for existing incomplete registrations
             if not existing_user.registration_completed:
-                verification_code = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
+                verification_code = f"{secrets.randbelow(1_000_000):06d}"
                 existing_user.verification_code = verification_code
                 existing_user.verification_code_expires = datetime.utcnow() + timedelta(minutes=10)
-                db.commit()
+                await db.commit()
             else:
                 verification_code = None
             
@@ -44,7 +140,7 @@ async def create_user(phone_number: str) -> Dict[str, Any]:
             }
         
         # Generate verification code
-        verification_code = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
+        verification_code = f"{secrets.randbelow(1_000_000):06d}"
         
         # Create user
         user = User(
@@ -55,8 +151,7 @@ async def create_user(phone_number: str) -> Dict[str, Any]:
         )
         
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
         
         logger.info(f"Created user: {phone_number}")
         
@@ -67,9 +162,6 @@ async def create_user(phone_number: str) -> Dict[str, Any]:
             "is_verified": False,
             "registration_completed": False
         }
-    
-    finally:
-        db.close()
 
 
 @activity.defn
@@ -84,60 +176,42 @@ async def verify_user_code(phone_number: str, code: str) -> bool:
     Returns:
         True if code is valid, False otherwise
     """
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.whatsapp_number == phone_number).first()
-        
-        if not user:
-            logger.warning(f"User not found: {phone_number}")
-            return False
-        
-        if user.is_verified:
-            logger.info(f"User already verified: {phone_number}")
-            return True
-        
-        if user.verification_code != code:
-            logger.warning(f"Invalid code for user: {phone_number}")
-            return False
-        
-        if datetime.utcnow() > user.verification_code_expires:
-            logger.warning(f"Expired code for user: {phone_number}")
-            return False
-        
-        # Mark as verified and generate nonce
-        user.is_verified = True
-        user.nonce = secrets.token_urlsafe(32)
-        db.commit()
-        
-        logger.info(f"User verified: {phone_number}")
-        return True
+    # Check and mark as verified in one statement
+    async with AsyncSessionLocal() as db:
+        user_id = await db.scalar(_VERIFY_USER_CODE, {
+            "p_phone": phone_number,
+            "p_code": code,
+            "p_now": datetime.utcnow(),
+            "p_nonce": generate_secure_token()
+        })
+        await db.commit()
+    
+    if user_id is None:
+        logger.warning(f"Invalid or expired code for user: {phone_number}")
+        return False
     
-    finally:
-        db.close()
+    logger.info(f"User verified: {phone_number}")
+    return True
 
 
 @activity.defn
 async def get_user(phone_number: str) -> Optional[Dict[str, Any]]:
-    """Get user data by phone number"""
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.whatsapp_number == phone_number).first()
-        
-        if not user:
-            return None
-        
-        return {
-            "id": user.id,
-            "phone_number": user.whatsapp_number,
-            "is_verified": user.is_verified,
-            "registration_completed": user.registration_completed,
-            "circle_wallet_id": user.circle_wallet_id,
-            "circle_wallet_address": user.circle_wallet_address,
-            "has_pin": user.pin_hash is not None
-        }
+    """Get user data by phone number (served from the user cache when possible)"""
+    user = await user_cache.get_cached_user(phone_number)
+    
+    if not user:
+        return None
     
-    finally:
-        db.close()
+    return {
+        "id": user.id,
+        "phone_number": phone_number,
+        "is_verified": user.is_verified,
+        "registration_completed": user.registration_completed,
+        "circle_wallet_id": user.circle_wallet_id,
+        "circle_wallet_address": user.circle_wallet_address,
+        "circle_usdc_token_id": user.circle_usdc_token_id,
+        "has_pin": user.pin_hash is not None
+    }
 
 @activity.defn
 async def auto_verify_user(phone_number: str) -> bool:
@@ -150,68 +224,52 @@ async def auto_verify_user(phone_number: str) -> bool:
     Returns:
         True if verified successfully
     """
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.whatsapp_number == phone_number).first()
-        
-        if not user:
-            logger.warning(f"User not found: {phone_number}")
-            return False
-        
-        # Mark as verified and generate nonce
-        user.is_verified = True
-        user.nonce = secrets.token_urlsafe(32)
-        db.commit()
-        
-        logger.info(f"User auto-verified: {phone_number}")
-        return True
+    async with AsyncSessionLocal() as db:
+        user_id = await db.scalar(_AUTO_VERIFY_USER, {
+            "p_phone": phone_number,
+            "p_nonce": generate_secure_token()
+        })
+        await db.commit()
+    
+    if user_id is None:
+        logger.warning(f"User not found: {phone_number}")
+        return False
     
-    finally:
-        db.close()
+    user_cache.invalidate_user(phone_number)
+    
+    logger.info(f"User auto-verified: {phone_number}")
+    return True
 
 @activity.defn
 async def update_user_pin(phone_number: str, pin_hash: str) -> bool:
-    """Update user's PIN hash (Argon2 hashed)"""
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.whatsapp_number == phone_number).first()
-        
-        if not user:
-            logger.error(f"User not found: {phone_number}")
-            return False
-        
-        # Store the Argon2 hash
-        user.pin_hash = pin_hash
-        db.commit()
-        
-        logger.info(f"PIN updated for user: {phone_number}")
-        return True
+    """Update user's PIN hash (Argon2 hashed; batched by the DB writer)"""
+    if not await db_writer.submit("user_pin", (phone_number, pin_hash)):
+        logger.error(f"User not found: {phone_number}")
+        return False
+    
+    user_cache.invalidate_user(phone_number)
     
-    finally:
-        db.close()
+    logger.info(f"PIN updated for user: {phone_number}")
+    return True
 
 
 @activity.defn
-async def update_user_wallet(phone_number: str, wallet_id: str, wallet_address: str) -> bool:
-    """Update user's Circle wallet information"""
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.whatsapp_number == phone_number).first()
-        
-        if not user:
-            logger.error(f"User not found: {phone_number}")
-            return False
-        
-        user.circle_wallet_id = wallet_id
-        user.circle_wallet_address = wallet_address
-        user.registration_completed = True
-        db.commit()
-        
-        logger.info(f"Wallet updated for user: {phone_number}")
-        return True
+async def update_user_wallet(
+    phone_number: str,
+    wallet_id: str,
+    wallet_address: str,
+    usdc_token_id: Optional[str] = None
+) -> bool:
+    """Update user's Circle wallet information (batched by the DB writer)"""
+    if not await db_writer.submit("user_wallet", (phone_number, wallet_id, wallet_address, usdc_token_id)):
+        logger.error(f"User not found: {phone_number}")
+        return False
+    
+    address_cache.invalidate_address(phone_number)
+    user_cache.invalidate_user(phone_number)
     
-    finally:
-        db.close()
+    logger.info(f"Wallet updated for user: {phone_number}")
+    return True
 
 
 @activity.defn
@@ -223,27 +281,22 @@ async def log_message(
     intent: Optional[str] = None,
     workflow_id: Optional[str] = None
 ) -> str:
-    """Log message to database"""
-    db = SessionLocal()
-    try:
-        message = Message(
-            user_id=phone_number,
-            direction=direction,
-            message_body=message_body,
-            message_sid=message_sid,
-            intent=intent,
-            workflow_id=workflow_id
-        )
-        
-        db.add(message)
-        db.commit()
-        db.refresh(message)
-        
-        logger.info(f"Logged {direction} message for {phone_number}")
-        return str(message.id)
+    """Log message to database (queued, written by the background flusher)"""
+    message = {
+        "id": str(uuid.uuid4()),
+        "user_id": phone_number,
+        "direction": direction,
+        "message_body": message_body,
+        "message_sid": message_sid,
+        "intent": intent,
+        "workflow_id": workflow_id,
+        "created_at": datetime.utcnow()
+    }
+    
+    await _message_log.put(message)
     
-    finally:
-        db.close()
+    logger.info(f"Queued {direction} message for {phone_number}")
+    return message["id"]
 
 
 @activity.defn
@@ -255,8 +308,7 @@ async def create_transaction(
     recipient_address: Optional[str] = None
 ) -> str:
     """Create transaction record"""
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         transaction = Transaction(
             id=str(uuid.uuid4()),
             user_id=phone_number,
@@ -268,14 +320,10 @@ async def create_transaction(
         )
         
         db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
+        await db.commit()
         
         logger.info(f"Created transaction {transaction.id} for {phone_number}")
         return transaction.id
-    
-    finally:
-        db.close()
 
 
 @activity.defn
@@ -284,25 +332,17 @@ async def update_transaction_status(
     status: str,
     tx_hash: Optional[str] = None
 ) -> bool:
-    """Update transaction status"""
-    db = SessionLocal()
-    try:
-        transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
-        
-        if not transaction:
-            logger.error(f"Transaction not found: {transaction_id}")
-            return False
-        
-        transaction.status = status
-        if tx_hash:
-            transaction.tx_hash = tx_hash
-        if status == "confirmed":
-            transaction.confirmed_at = datetime.utcnow()
-        
-        db.commit()
-        
-        logger.info(f"Transaction {transaction_id} updated to {status}")
-        return True
+    """Update transaction status (batched by the DB writer)"""
+    updated = await db_writer.submit("transaction_status", (
+        transaction_id,
+        status,
+        tx_hash or None,
+        datetime.utcnow() if status == "confirmed" else None
+    ))
+    
+    if not updated:
+        logger.error(f"Transaction not found: {transaction_id}")
+        return False
     
-    finally:
-        db.close()
\ No newline at end of file
+    logger.info(f"Transaction {transaction_id} updated to {status}")
+    return True
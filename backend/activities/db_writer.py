@@ -0,0 +1,158 @@
+from models.database import User, Transaction, AsyncSessionLocal
+from sqlalchemy import update, values, column, cast, func, String, DateTime, Uuid
+from types import MappingProxyType
+from utils.batch_queue import BatchQueue
+from typing import Tuple
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# User/transaction updates from many workflows are queued and applied in
+# batches: one UPDATE ... FROM (VALUES ...) per write kind, one commit per batch.
+# No wait window: a lone write is applied at once, writes queued behind a
+# running batch go together in the next one
+WRITE_FLUSH_INTERVAL = 0  # seconds
+WRITE_FLUSH_BATCH_SIZE = 256
+
+
+def _update_user_pin(rows: list):
+    v = values(
+        column("phone", String),
+        column("pin_hash", String),
+        name="v"
+    ).data(rows)
+    return (
+        update(User)
+        .where(User.whatsapp_number == v.c.phone)
+        .values(pin_hash=v.c.pin_hash)
+        .returning(User.whatsapp_number)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _update_user_wallet(rows: list):
+    v = values(
+        column("phone", String),
+        column("wallet_id", String),
+        column("wallet_address", String),
+        column("usdc_token_id", String),
+        name="v"
+    ).data(rows)
+    return (
+        update(User)
+        .where(User.whatsapp_number == v.c.phone)
+        .values(
+            circle_wallet_id=v.c.wallet_id,
+            circle_wallet_address=v.c.wallet_address,
+            circle_usdc_token_id=v.c.usdc_token_id,
+            registration_completed=True
+        )
+        .returning(User.whatsapp_number)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _update_transaction_status(rows: list):
+    v = values(
+        column("id", Uuid(as_uuid=False)),
+        column("status", String),
+        column("tx_hash", String),
+        column("confirmed_at", DateTime),
+        name="v"
+    ).data(rows)
+    return (
+        update(Transaction)
+        .where(Transaction.id == v.c.id)
+        .values(
+            status=v.c.status,
+            # NULL leaves the stored value unchanged; the cast types an all-NULL VALUES column
+            tx_hash=func.coalesce(v.c.tx_hash, Transaction.tx_hash),
+            confirmed_at=func.coalesce(cast(v.c.confirmed_at, DateTime), Transaction.confirmed_at)
+        )
+        .returning(Transaction.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Write kind -> statement builder; the first value of each row is the key RETURNING reports back
+_STATEMENTS = MappingProxyType({
+    "user_pin": _update_user_pin,
+    "user_wallet": _update_user_wallet,
+    "transaction_status": _update_transaction_status,
+})
+
+
+async def _execute(groups: dict) -> dict:
+    """Run one UPDATE per write kind in a single transaction; returns the keys each one updated"""
+    async with AsyncSessionLocal() as db:
+        updated = {}
+        for kind, group in groups.items():
+            statement = _STATEMENTS[kind]([row for row, _ in group.values()])
+            updated[kind] = set((await db.scalars(statement)).all())
+        await db.commit()
+    return updated
+
+
+async def _apply(batch: list) -> None:
+    """Apply a batch in one transaction and resolve each write's future with whether its row existed"""
+    groups = {}
+    deferred = []
+    for kind, row, future in batch:
+        group = groups.setdefault(kind, {})
+        # A row may appear once per UPDATE ... FROM; repeats go in the next round
+        if row[0] in group:
+            deferred.append((kind, row, future))
+        else:
+            group[row[0]] = (row, future)
+    
+    size = len(batch) - len(deferred)
+    try:
+        updated = await _execute(groups)
+    except Exception as e:
+        if size > 1:
+            # The transaction was rolled back; retry each write alone so only the bad row fails
+            logger.warning(f"Failed to apply {size} queued writes, applying them one by one: {str(e)}")
+            for kind, group in groups.items():
+                for row, future in group.values():
+                    await _apply([(kind, row, future)])
+        else:
+            logger.error(f"Failed to apply queued write: {str(e)}")
+            for group in groups.values():
+                for _, future in group.values():
+                    if not future.done():
+                        future.set_exception(e)
+    else:
+        for kind, group in groups.items():
+            for key, (_, future) in group.items():
+                if not future.done():
+                    future.set_result(key in updated[kind])
+        logger.info(f"Applied {size} queued writes")
+    
+    if deferred:
+        await _apply(deferred)
+
+
+# Drained by a background task started on the first submitted write
+_writes = BatchQueue(_apply, WRITE_FLUSH_BATCH_SIZE, WRITE_FLUSH_INTERVAL)
+
+
+async def submit(kind: str, row: Tuple) -> bool:
+    """
+    Queue a write and wait until its batch is committed
+    
+    Args:
+        kind: Key into _STATEMENTS
+        row: Values for that statement's VALUES columns, key first
+    
+    Returns:
+        True if the target row existed and was updated
+    """
+    future = asyncio.get_running_loop().create_future()
+    await _writes.put((kind, row, future))
+    return await future
+
+
+async def flush() -> None:
+    """Apply any queued writes and stop the writer (called on worker shutdown)"""
+    await _writes.close()
\ No newline at end of file
@@ -0,0 +1,15 @@
+from temporalio.exceptions import ApplicationError
+
+
+class TransferDeniedError(ApplicationError):
+    """Circle failed or denied the transfer (retrying won't change the outcome)"""
+    
+    def __init__(self, message: str):
+        super().__init__(message, type="TransferDeniedError", non_retryable=True)
+
+
+class InvalidTokenError(ApplicationError):
+    """No usable USDC token id for the transfer"""
+    
+    def __init__(self, message: str):
+        super().__init__(message, type="InvalidTokenError", non_retryable=True)
@@ -1,7 +1,8 @@
 from temporalio import activity
-from models.database import User, SessionLocal
+from cache import user_cache
 from utils.security import verify_pin
 from typing import Dict, Any
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,9 +20,8 @@ async def verify_user_pin(phone_number: str, provided_pin_hash: str) -> Dict[str
     Returns:
         Dict with verification result
     """
-    db = SessionLocal()
     try:
-        user = db.query(User).filter(User.whatsapp_number == phone_number).first()
+        user = await user_cache.get_cached_user(phone_number)
         
         if not user:
             logger.warning(f"User not found: {phone_number}")
@@ -37,8 +37,9 @@ async def verify_user_pin(phone_number: str, provided_pin_hash: str) -> Dict[str
                 "error": "pin_not_set"
             }
         
-        # Verify the PIN (stored hash is Argon2 of client SHA256)
-        is_valid = verify_pin(user.pin_hash, provided_pin_hash)
+        # Verify the PIN (stored hash is Argon2 of client SHA256); Argon2 is
+        # deliberately slow, so keep it off the event loop
+        is_valid = await asyncio.to_thread(verify_pin, user.pin_hash, provided_pin_hash)
         
         if is_valid:
             logger.info(f"PIN verified successfully for {phone_number}")
@@ -58,7 +59,4 @@ async def verify_user_pin(phone_number: str, provided_pin_hash: str) -> Dict[str
         return {
             "verified": False,
             "error": "verification_failed"
-        }
-    
-    finally:
-        db.close()
\ No newline at end of file
+        }
\ No newline at end of file
@@ -1,10 +1,48 @@
 from temporalio import activity
 from services.twilio_service import twilio_service
-from typing import Optional
+from config import settings
+from typing import Optional, List, Tuple
+from urllib.parse import quote
+import asyncio
+import functools
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Outbound send limits for batches (keep under the account's Twilio rate limit)
+TWILIO_MAX_CONCURRENT_SENDS = 16
+TWILIO_MESSAGES_PER_SECOND = 50
+
+
+class _SendThrottle:
+    """Space out sends at a fixed rate so we don't rely on 429 backoff"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+    
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+_send_throttle = _SendThrottle(TWILIO_MESSAGES_PER_SECOND)
+
+_PIN_SETUP_BASE_URL = f"{settings.BACKEND_PUBLIC_URL}/setup-pin"
+_PIN_SETUP_BODY = """🔒 Let's create your ArcAgent wallet
+
+Click the link below to set up your PIN:
+{url}
+
+This link expires in 15 minutes.
+Never share this link with anyone!
+    """
+_quote = functools.partial(quote, safe='')
+
 
 @activity.defn
 async def send_verification_code(phone_number: str, code: str) -> str:
@@ -24,7 +62,7 @@ async def send_verification_code(phone_number: str, code: str) -> str:
     if logger.level == logging.DEBUG:
         logger.debug(f"Verification code for {phone_number}: {code}")
     
-    message_sid = twilio_service.send_verification_code(phone_number, code)
+    message_sid = await twilio_service.send_verification_code(phone_number, code)
     return message_sid
 
 
@@ -32,7 +70,7 @@ async def send_verification_code(phone_number: str, code: str) -> str:
 async def send_welcome_message(phone_number: str, user_name: Optional[str] = None) -> str:
     """Send welcome message after successful registration"""
     logger.info(f"Sending welcome message to {phone_number}")
-    message_sid = twilio_service.send_welcome_message(phone_number, user_name)
+    message_sid = await twilio_service.send_welcome_message(phone_number, user_name)
     return message_sid
 
 
@@ -51,21 +89,12 @@ async def send_pin_setup_link(phone_number: str, setup_token: str) -> str:
     logger.info(f"Sending PIN setup link to {phone_number}")
     
     # Clean phone number for URL (remove any special characters)
-    from urllib.parse import quote
     clean_phone = phone_number.strip().replace(' ', '')
     
-    setup_url = f"http://localhost:8000/setup-pin?token={setup_token}&phone={quote(clean_phone)}"
-    
-    body = f"""🔒 Let's create your ArcAgent wallet
-
-Click the link below to set up your PIN:
-{setup_url}
-
-This link expires in 15 minutes.
-Never share this link with anyone!
-    """
+    setup_url = f"{_PIN_SETUP_BASE_URL}?token={setup_token}&phone={_quote(clean_phone)}"
+    body = _PIN_SETUP_BODY.format_map({"url": setup_url})
     
-    message_sid = twilio_service.send_message(phone_number, body)
+    message_sid = await twilio_service.send_message(phone_number, body)
     return message_sid
 
 
@@ -78,7 +107,7 @@ async def send_confirmation_request(
 ) -> str:
     """Request confirmation from user for an action"""
     logger.info(f"Requesting confirmation from {phone_number} for {action}")
-    message_sid = twilio_service.send_confirmation_request(
+    message_sid = await twilio_service.send_confirmation_request(
         phone_number,
         action,
         amount,
@@ -97,7 +126,7 @@ async def send_transaction_receipt(
 ) -> str:
     """Send transaction receipt to user"""
     logger.info(f"Sending receipt to {phone_number} for tx {tx_hash}")
-    message_sid = twilio_service.send_transaction_receipt(
+    message_sid = await twilio_service.send_transaction_receipt(
         phone_number,
         amount,
         recipient,
@@ -111,7 +140,7 @@ async def send_transaction_receipt(
 async def send_error_message(phone_number: str, error_type: str = "general") -> str:
     """Send error message to user"""
     logger.info(f"Sending error message to {phone_number}: {error_type}")
-    message_sid = twilio_service.send_error_message(phone_number, error_type)
+    message_sid = await twilio_service.send_error_message(phone_number, error_type)
     return message_sid
 
 
@@ -119,5 +148,34 @@ async def send_error_message(phone_number: str, error_type: str = "general") ->
 async def send_custom_message(phone_number: str, message: str) -> str:
     """Send custom message to user"""
     logger.info(f"Sending custom message to {phone_number}")
-    message_sid = twilio_service.send_message(phone_number, message)
-    return message_sid
\ No newline at end of file
+    message_sid = await twilio_service.send_message(phone_number, message)
+    return message_sid
+
+
+@activity.defn
+async def send_messages_batch(messages: List[Tuple[str, str]]) -> List[Optional[str]]:
+    """
+    Send many messages concurrently, throttled to the Twilio rate limit
+    
+    Sends go straight to the REST API on the shared HTTP client, so the
+    whole batch is in flight on the event loop rather than in threads.
+    
+    Args:
+        messages: (phone_number, body) pairs
+    
+    Returns:
+        Message SIDs in input order (None for sends that failed)
+    """
+    logger.info(f"Sending batch of {len(messages)} messages")
+    semaphore = asyncio.Semaphore(TWILIO_MAX_CONCURRENT_SENDS)
+    
+    async def send(phone_number: str, body: str) -> Optional[str]:
+        async with semaphore:
+            await _send_throttle.wait()
+            try:
+                return await twilio_service.send_message(phone_number, body)
+            except Exception as e:
+                logger.error(f"Batch send to {phone_number} failed: {str(e)}")
+                return None
+    
+    return await asyncio.gather(*(send(phone_number, body) for phone_number, body in messages))
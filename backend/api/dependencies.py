@@ -1,19 +1,44 @@
 from fastapi import HTTPException, Header
 from temporalio.client import Client
+import asyncio
+import hmac
 import logging
 from config import settings
+import temporal_client
 
 logger = logging.getLogger(__name__)
 
+# Set once the shared Temporal client has connected
+_temporal_ready = asyncio.Event()
+
+# How long a request waits for a not-yet-connected client before giving up with 503
+TEMPORAL_READY_TIMEOUT = 2.0
+
 
 async def verify_api_key(x_api_key: str = Header(...)):
     """Verify API key from Cloudflare Worker"""
     expected_key = settings.BACKEND_API_KEY
-    if x_api_key != expected_key:
+    # Constant-time compare so response timing doesn't leak matching prefixes
+    if not hmac.compare_digest(x_api_key.encode(), expected_key.encode()):
         raise HTTPException(status_code=403, detail="Invalid API key")
     return x_api_key
 
 
+async def connect_temporal_with_backoff() -> Client:
+    """Connect the shared Temporal client in the background, retrying until it succeeds"""
+    client = await temporal_client.connect_with_backoff()
+    _temporal_ready.set()
+    return client
+
+
 async def get_temporal_client() -> Client:
-    """Get Temporal client instance"""
-    return await Client.connect(settings.TEMPORAL_HOST)
\ No newline at end of file
+    """Get the shared Temporal client (503 if it isn't connected yet)"""
+    client = temporal_client.current_client()
+    if client is None:
+        try:
+            await asyncio.wait_for(_temporal_ready.wait(), timeout=TEMPORAL_READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Temporal is not available yet")
+        client = temporal_client.current_client()
+    
+    return client
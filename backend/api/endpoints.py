@@ -1,39 +1,49 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
-from fastapi.responses import PlainTextResponse, HTMLResponse
-from pathlib import Path
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.responses import PlainTextResponse, HTMLResponse, StreamingResponse
 from pydantic import BaseModel
+from temporalio.exceptions import WorkflowAlreadyStartedError
+from temporalio.service import RPCError, RPCStatusCode
 from typing import Optional, List, Dict, Any
-from temporalio.client import Client
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
+import asyncio
 import base64
+import hashlib
+import hmac
+import json
+import orjson
+import time
 
 from config import settings
-from models.database import init_db, get_db, User, Transaction
+from api.dependencies import get_temporal_client
+from models.database import AsyncSessionLocal, User, Transaction
 from workflows import RegistrationWorkflow, PaymentWorkflow
 from services import twilio_service, circle_service
 from services.elevenlabs_service import elevenlabs_service
-from sqlalchemy.orm import Session
-from fastapi.staticfiles import StaticFiles
+from cache import user_cache, pending_payments, media_store
+from activities.circle_activities import get_wallet_balance
+from utils.security import hash_pin
+from sqlalchemy import select
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="ArcAgent API")
-static_dir = Path("/app/static")
-static_dir.mkdir(parents=True, exist_ok=True)
-app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
-# Initialize database on startup
-@app.on_event("startup")
-async def startup_event():
-    init_db()
-    logger.info("Database initialized")
+_WA_PREFIX = "whatsapp:"
+
+# Webhook acknowledgement body, serialized once
+_WEBHOOK_ACK = orjson.dumps({"success": True})
+
+# Bound on asking a duplicate payment's earlier run where it is
+PAYMENT_STATUS_QUERY_TIMEOUT = timedelta(seconds=3)
+
+router = APIRouter()
 
 
 # Dependency for API key authentication
 async def verify_api_key(x_api_key: str = Header(...)):
     """Verify API key from Cloudflare Worker"""
     expected_key = settings.BACKEND_API_KEY
-    if x_api_key != expected_key:
+    # Constant-time compare so response timing doesn't leak matching prefixes
+    if not hmac.compare_digest(x_api_key.encode(), expected_key.encode()):
         raise HTTPException(status_code=403, detail="Invalid API key")
     return x_api_key
 
@@ -61,7 +71,8 @@ class SendMoneyRequest(BaseModel):
 
 class WorkflowActionRequest(BaseModel):
     phone_number: str
-    workflow_id: str
+    # Falls back to the user's pending payment when omitted
+    workflow_id: Optional[str] = None
 
 
 class SendMessageRequest(BaseModel):
@@ -76,17 +87,26 @@ class TranscribeAudioRequest(BaseModel):
 class GenerateSpeechRequest(BaseModel):
     text: str
     to: str
+    include_text: bool = False  # also send the text, overlapped with TTS
+
+
+class WorkflowSignal(BaseModel):
+    workflow_id: str
+    signal: str
+    payload: Optional[Any] = None
+
 
+class BatchSignalRequest(BaseModel):
+    signals: List[WorkflowSignal]
 
-# Helper to get Temporal client
-async def get_temporal_client() -> Client:
-    """Get Temporal client instance"""
-    return await Client.connect(settings.TEMPORAL_HOST)
+
+# Signals that carry no server-side processing (set_pin must go through its endpoint)
+BATCH_SIGNALS = {"verify_code", "confirm_payment", "cancel_payment"}
 
 
 # ============ API ENDPOINTS ============
 
-@app.post("/api/register")
+@router.post("/api/register")
 async def register_user(
     request: RegisterRequest,
     api_key: str = Depends(verify_api_key)
@@ -122,14 +142,12 @@ async def register_user(
                 "message": "Registration started. Check your WhatsApp for verification code.",
             }
             
-        except Exception as e:
-            if "already started" in str(e).lower():
-                return {
-                    "success": True,
-                    "workflow_id": workflow_id,
-                    "message": "Registration already in progress. Please complete the steps sent to your WhatsApp.",
-                }
-            raise
+        except WorkflowAlreadyStartedError:
+            return {
+                "success": True,
+                "workflow_id": workflow_id,
+                "message": "Registration already in progress. Please complete the steps sent to your WhatsApp.",
+            }
             
     except Exception as e:
         logger.error(f"Registration error: {str(e)}")
@@ -139,7 +157,7 @@ async def register_user(
             "message": "Failed to start registration. Please try again.",
         }
 
-@app.post("/api/workflow/verify-code")
+@router.post("/api/workflow/verify-code")
 async def verify_code_workflow(
     request: VerifyCodeRequest,
     api_key: str = Depends(verify_api_key)
@@ -164,16 +182,14 @@ async def verify_code_workflow(
             "message": "Failed to verify code.",
         }
         
-@app.post("/api/workflow/set-pin")
+@router.post("/api/workflow/set-pin")
 async def set_pin_workflow(
     request: SetPinRequest
 ):
     """Send PIN setup signal to registration workflow"""
     try:
-        from utils.security import hash_pin
-        
         # Hash the client-provided hash with Argon2 (double hashing for security)
-        final_hash = hash_pin(request.pin_hash)
+        final_hash = await asyncio.to_thread(hash_pin, request.pin_hash)
         
         client = await get_temporal_client()
         handle = client.get_workflow_handle(request.workflow_id)
@@ -183,6 +199,9 @@ async def set_pin_workflow(
             "token": request.token
         })
         
+        # This process may hold the user in its cache; the worker invalidates its own
+        user_cache.invalidate_user(request.phone_number)
+        
         logger.info(f"PIN setup signal sent for {request.phone_number}")
         
         return {
@@ -198,11 +217,10 @@ async def set_pin_workflow(
             "message": "Failed to set PIN.",
         }      
         
-@app.post("/api/payment/send")
+@router.post("/api/payment/send")
 async def send_money(
     request: SendMoneyRequest,
-    api_key: str = Depends(verify_api_key),
-    db: Session = Depends(get_db)
+    api_key: str = Depends(verify_api_key)
 ):
     """
     Initiate payment workflow
@@ -214,7 +232,7 @@ async def send_money(
     4. Sends receipt
     """
     try:
-        user = db.query(User).filter(User.whatsapp_number == request.phone_number).first()
+        user = await user_cache.get_cached_user(request.phone_number)
         if not user or not user.registration_completed:
             return {
                 "success": False,
@@ -231,14 +249,49 @@ async def send_money(
         
         client = await get_temporal_client()
         
-        workflow_id = f"payment-{request.phone_number}-{int(datetime.now().timestamp())}"
+        # Same user, amount and recipient -> same ID, so duplicate requests collapse
+        # onto the running workflow (blake2b is stable across processes, unlike hash())
+        recipient_digest = hashlib.blake2b(request.recipient.encode("utf-8"), digest_size=8).hexdigest()
+        workflow_id = f"payment-{request.phone_number}-{round(request.amount * 100)}-{recipient_digest}"
         
-        handle = await client.start_workflow(
-            PaymentWorkflow.run,
-            args=[request.phone_number, request.amount, request.recipient],
-            id=workflow_id,
-            task_queue=settings.TEMPORAL_TASK_QUEUE,
-        )
+        try:
+            handle = await client.start_workflow(
+                PaymentWorkflow.run,
+                args=[request.phone_number, request.amount, request.recipient],
+                id=workflow_id,
+                task_queue=settings.TEMPORAL_TASK_QUEUE,
+            )
+        except WorkflowAlreadyStartedError:
+            logger.info(f"Payment workflow {workflow_id} already running")
+            
+            # Word the reply after the earlier run's stage; it may be past confirmation
+            try:
+                status = await client.get_workflow_handle(workflow_id).query(
+                    PaymentWorkflow.get_status,
+                    rpc_timeout=PAYMENT_STATUS_QUERY_TIMEOUT
+                )
+            except Exception as e:
+                logger.warning(f"Could not query payment workflow {workflow_id}: {str(e)}")
+                status = None
+            
+            if status and not status["confirmed"] and not status["cancelled"]:
+                message = f"Payment of ${request.amount:.2f} to {request.recipient} is already awaiting confirmation."
+            else:
+                message = (
+                    f"An identical payment of ${request.amount:.2f} to {request.recipient} is still being processed. "
+                    "To send it again, wait for it to finish first."
+                )
+            
+            return {
+                "success": True,
+                "workflow_id": workflow_id,
+                "message": message,
+                "amount": request.amount,
+                "recipient": request.recipient,
+            }
+        
+        # CONFIRM/CANCEL look this up directly instead of scanning running workflows
+        await pending_payments.set_pending_payment(request.phone_number, workflow_id)
         
         logger.info(f"Started payment workflow {workflow_id}")
         
@@ -259,15 +312,14 @@ async def send_money(
         }
 
 
-@app.get("/api/balance/{phone_number}")
+@router.get("/api/balance/{phone_number}")
 async def check_balance(
     phone_number: str,
-    api_key: str = Depends(verify_api_key),
-    db: Session = Depends(get_db)
+    api_key: str = Depends(verify_api_key)
 ):
     """Get user's wallet balance"""
     try:
-        user = db.query(User).filter(User.whatsapp_number == phone_number).first()
+        user = await user_cache.get_cached_user(phone_number)
         
         if not user or not user.registration_completed:
             return {
@@ -276,7 +328,6 @@ async def check_balance(
                 "message": "You need to register first.",
             }
         
-        from activities.circle_activities import get_wallet_balance
         balance = await get_wallet_balance(user.circle_wallet_id)
         
         return {
@@ -295,73 +346,114 @@ async def check_balance(
         }
 
 
-@app.get("/api/transactions/{phone_number}")
+# Rows fetched per round-trip while streaming transaction history
+TX_STREAM_BATCH_SIZE = 100
+
+# Most transactions one history request may ask for
+TX_HISTORY_MAX_LIMIT = 100
+
+
+@router.get("/api/transactions/{phone_number}")
 async def get_transactions(
     phone_number: str,
-    limit: int = 10,
-    api_key: str = Depends(verify_api_key),
-    db: Session = Depends(get_db)
+    limit: int = Query(10, ge=1, le=TX_HISTORY_MAX_LIMIT),
+    api_key: str = Depends(verify_api_key)
 ):
-    """Get transaction history"""
+    """Get transaction history (streamed as it is read from the database)"""
+    # The session outlives this handler, so it is closed by the stream instead of a dependency
+    db = AsyncSessionLocal()
     try:
-        user = db.query(User).filter(User.whatsapp_number == phone_number).first()
-        
-        if not user:
-            return {
-                "success": False,
-                "error": "user_not_found",
-                "transactions": [],
-            }
-        
-        transactions = (
-            db.query(Transaction)
-            .filter(Transaction.user_id == phone_number)
+        # One round-trip: no rows means no user, a NULL transaction means no history
+        rows = await db.stream(
+            select(
+                User.id.label("user_id"),
+                Transaction.id,
+                Transaction.transaction_type,
+                Transaction.amount,
+                Transaction.recipient,
+                Transaction.status,
+                Transaction.tx_hash,
+                Transaction.created_at,
+                Transaction.confirmed_at
+            )
+            .outerjoin(Transaction, Transaction.user_id == User.whatsapp_number)
+            .where(User.whatsapp_number == phone_number)
             .order_by(Transaction.created_at.desc())
             .limit(limit)
-            .all()
+            .execution_options(yield_per=TX_STREAM_BATCH_SIZE)
         )
-        
-        tx_list = [
-            {
-                "id": tx.id,
-                "type": tx.transaction_type,
-                "amount": tx.amount,
-                "recipient": tx.recipient,
-                "status": tx.status,
-                "tx_hash": tx.tx_hash,
-                "created_at": tx.created_at.isoformat(),
-                "confirmed_at": tx.confirmed_at.isoformat() if tx.confirmed_at else None,
-            }
-            for tx in transactions
-        ]
-        
-        return {
-            "success": True,
-            "transactions": tx_list,
-            "count": len(tx_list),
-        }
-        
+        first_row = await rows.fetchone()
     except Exception as e:
+        await db.close()
         logger.error(f"Transaction history error: {str(e)}")
         return {
             "success": False,
             "error": str(e),
             "transactions": [],
         }
+    
+    if first_row is None:
+        await db.close()
+        return {
+            "success": False,
+            "error": "user_not_found",
+            "transactions": [],
+        }
+    
+    async def stream_body():
+        # success goes last: the 200 is already sent when a later row fails, so the
+        # body must still close as valid JSON that reports the failure
+        count = 0
+        try:
+            yield b'{"transactions":['
+            
+            row = first_row
+            while row is not None:
+                if row.id is not None:
+                    yield (b"," if count else b"") + orjson.dumps({
+                        "id": row.id,
+                        "type": row.transaction_type,
+                        "amount": row.amount,
+                        "recipient": row.recipient,
+                        "status": row.status,
+                        "tx_hash": row.tx_hash,
+                        "created_at": row.created_at,
+                        "confirmed_at": row.confirmed_at,
+                    })
+                    count += 1
+                row = await rows.fetchone()
+            
+            yield b'],"count":' + str(count).encode() + b',"success":true}'
+        except Exception as e:
+            logger.error(f"Transaction history stream error: {str(e)}")
+            yield b'],"count":' + str(count).encode() + b',"success":false,"error":' + orjson.dumps(str(e)) + b'}'
+        finally:
+            await db.close()
+    
+    return StreamingResponse(stream_body(), media_type="application/json")
 
 
-@app.post("/api/workflow/confirm")
+@router.post("/api/workflow/confirm")
 async def confirm_workflow(
     request: WorkflowActionRequest,
     api_key: str = Depends(verify_api_key)
 ):
     """Send confirmation signal to workflow"""
     try:
+        workflow_id = request.workflow_id or await pending_payments.get_pending_payment(request.phone_number)
+        if not workflow_id:
+            return {
+                "success": False,
+                "error": "no_pending_payment",
+                "message": "No pending payment to confirm.",
+            }
+        
         client = await get_temporal_client()
-        handle = client.get_workflow_handle(request.workflow_id)
+        handle = client.get_workflow_handle(workflow_id)
         
-        if "payment" in request.workflow_id:
+        if "payment" in workflow_id:
             await handle.signal("confirm_payment")
+            await pending_payments.clear_pending_payment(request.phone_number)
         
         return {
             "success": True,
@@ -377,37 +469,41 @@ async def confirm_workflow(
         }
 
 
-@app.post("/api/workflow/cancel")
+@router.post("/api/workflow/cancel")
 async def cancel_workflow(
     request: WorkflowActionRequest,
     api_key: str = Depends(verify_api_key)
 ):
     """Send cancellation signal to workflow"""
     try:
-        client = await get_temporal_client()
-        handle = client.get_workflow_handle(request.workflow_id)
-        
-        # Check if workflow is running
-        try:
-            description = await handle.describe()
-            if description.status.name not in ["RUNNING", "PENDING"]:
-                return {
-                    "success": False,
-                    "error": "workflow_not_active",
-                    "message": f"Workflow is {description.status.name}, cannot cancel.",
-                }
-        except Exception as desc_error:
-            logger.error(f"Could not describe workflow: {desc_error}")
+        workflow_id = request.workflow_id or await pending_payments.get_pending_payment(request.phone_number)
+        if not workflow_id:
             return {
                 "success": False,
-                "error": "workflow_not_found",
-                "message": "Workflow not found or already completed.",
+                "error": "no_pending_payment",
+                "message": "No pending payment to cancel.",
             }
         
-        # Send cancel signal
-        if "payment" in request.workflow_id:
-            await handle.signal("cancel_payment")
-            logger.info(f"Cancel signal sent to workflow: {request.workflow_id}")
+        client = await get_temporal_client()
+        handle = client.get_workflow_handle(workflow_id)
+        
+        # Send cancel signal; signalling a finished workflow fails with NOT_FOUND,
+        # so there's no need for a separate describe() round-trip first
+        if "payment" in workflow_id:
+            try:
+                await handle.signal("cancel_payment")
+            except RPCError as signal_error:
+                if signal_error.status != RPCStatusCode.NOT_FOUND:
+                    raise
+                logger.error(f"Could not signal workflow: {signal_error}")
+                await pending_payments.clear_pending_payment(request.phone_number)
+                return {
+                    "success": False,
+                    "error": "workflow_not_found",
+                    "message": "Workflow not found or already completed.",
+                }
+            await pending_payments.clear_pending_payment(request.phone_number)
+            logger.info(f"Cancel signal sent to workflow: {workflow_id}")
         
         return {
             "success": True,
@@ -423,15 +519,94 @@ async def cancel_workflow(
         }
 
 
-@app.post("/api/send-message")
+@router.post("/api/workflow/batch-signal")
+async def batch_signal_workflows(
+    request: BatchSignalRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """Send several workflow signals concurrently"""
+    client = await get_temporal_client()
+    
+    async def send(item: WorkflowSignal) -> Dict[str, Any]:
+        if item.signal not in BATCH_SIGNALS:
+            return {"workflow_id": item.workflow_id, "success": False, "error": "signal_not_allowed"}
+        
+        try:
+            handle = client.get_workflow_handle(item.workflow_id)
+            if item.payload is None:
+                await handle.signal(item.signal)
+            else:
+                await handle.signal(item.signal, item.payload)
+            return {"workflow_id": item.workflow_id, "success": True}
+        except Exception as e:
+            logger.error(f"Batch signal {item.signal} to {item.workflow_id} failed: {str(e)}")
+            return {"workflow_id": item.workflow_id, "success": False, "error": str(e)}
+    
+    results = await asyncio.gather(*(send(item) for item in request.signals))
+    
+    return {
+        "success": all(result["success"] for result in results),
+        "results": results,
+    }
+
+
+@router.post("/circle/webhook")
+async def circle_webhook(
+    request: Request,
+    x_circle_key_id: Optional[str] = Header(None),
+    x_circle_signature: Optional[str] = Header(None)
+):
+    """Receive Circle transaction notifications and signal the payment workflow"""
+    body = await request.body()
+    
+    if not x_circle_key_id or not x_circle_signature:
+        raise HTTPException(status_code=401, detail="Missing signature")
+    
+    try:
+        is_valid = await circle_service.verify_notification(body, x_circle_key_id, x_circle_signature)
+    except Exception as e:
+        logger.error(f"Circle webhook verification error: {str(e)}")
+        is_valid = False
+    
+    if not is_valid:
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    
+    payload = json.loads(body)
+    notification = payload.get("notification") or {}
+    
+    # Transfers are created with the payment workflow ID as refId
+    workflow_id = notification.get("refId") or ""
+    if payload.get("notificationType") != "transactions.outbound" or not workflow_id.startswith("payment-"):
+        return Response(_WEBHOOK_ACK, media_type="application/json")
+    
+    try:
+        client = await get_temporal_client()
+        handle = client.get_workflow_handle(workflow_id)
+        
+        await handle.signal("transfer_completed", {
+            "transfer_id": notification.get("id"),
+            "state": notification.get("state"),
+            "tx_hash": notification.get("txHash"),
+        })
+        
+        logger.info(f"Transfer update sent to workflow: {workflow_id}")
+        
+    except Exception as e:
+        # Workflow may already be finished; don't make Circle retry
+        logger.warning(f"Could not signal workflow {workflow_id}: {str(e)}")
+    
+    return Response(_WEBHOOK_ACK, media_type="application/json")
+
+
+@router.post("/api/send-message")
 async def send_message(
     request: SendMessageRequest,
     api_key: str = Depends(verify_api_key)
 ):
     """Send message to user via Twilio"""
     try:
-        message_sid = twilio_service.send_message(
-            to=request.to if request.to.startswith('whatsapp:') else f'whatsapp:{request.to}',
+        message_sid = await twilio_service.send_message(
+            to=request.to if request.to[:9] == _WA_PREFIX else _WA_PREFIX + request.to,
             body=request.message
         )
         
@@ -448,14 +623,14 @@ async def send_message(
         }
 
 
-@app.post("/api/transcribe-audio")
+@router.post("/api/transcribe-audio")
 async def transcribe_audio(
     request: TranscribeAudioRequest,
     api_key: str = Depends(verify_api_key)
 ):
     """Transcribe audio using Eleven Labs STT"""
     try:
-        transcribed_text = elevenlabs_service.transcribe_audio(request.audio_url)
+        transcribed_text = await elevenlabs_service.transcribe_audio(request.audio_url)
         
         if transcribed_text:
             return {
@@ -476,30 +651,51 @@ async def transcribe_audio(
         }
 
 
-@app.post("/api/generate-speech")
+@router.post("/api/generate-speech")
 async def generate_speech(
     request: GenerateSpeechRequest,
     api_key: str = Depends(verify_api_key)
 ):
     """Generate speech using Eleven Labs TTS and send via WhatsApp"""
+    to = request.to if request.to[:9] == _WA_PREFIX else _WA_PREFIX + request.to
+    text_message_sid = None
+    
     try:
-        audio_data = elevenlabs_service.generate_speech(request.text)
+        # TTS audio streams straight into the media store; it is never buffered whole
+        render_speech = media_store.store_media_stream(
+            elevenlabs_service.generate_speech_stream(request.text)
+        )
+        
+        if request.include_text:
+            # The text reply goes out while the TTS renders; the voice note follows it
+            token, text_result = await asyncio.gather(
+                render_speech,
+                twilio_service.send_message(to, request.text),
+                return_exceptions=True
+            )
+            if isinstance(text_result, Exception):
+                logger.error(f"Text reply failed: {str(text_result)}")
+            else:
+                text_message_sid = text_result
+            if isinstance(token, Exception):
+                raise token
+        else:
+            token = await render_speech
         
-        if not audio_data:
+        if not token:
             return {
                 "success": False,
                 "error": "Failed to generate speech",
+                "text_message_sid": text_message_sid,
             }
         
-        # Send audio message via Twilio (handles upload internally)
-        message_sid = twilio_service.send_audio_message(
-            to=request.to if request.to.startswith('whatsapp:') else f'whatsapp:{request.to}',
-            audio_data=audio_data
-        )
+        # Send audio message via Twilio (Twilio fetches it from /media)
+        message_sid = await twilio_service.send_stored_audio(to, token)
         
         return {
             "success": True,
             "message_sid": message_sid,
+            "text_message_sid": text_message_sid,
         }
         
     except Exception as e:
@@ -507,20 +703,48 @@ async def generate_speech(
         return {
             "success": False,
             "error": str(e),
+            "text_message_sid": text_message_sid,
         }
 
 
-@app.get("/setup-pin", response_class=HTMLResponse)
-async def serve_pin_setup():
-    """Serve PIN setup page"""
-    html_file = Path(__file__).parent.parent / "pin-setup.html"
-    return html_file.read_text()
+@router.get("/media/{token}")
+async def serve_media(token: str):
+    """Serve a stored audio clip to Twilio (token is unguessable and expires)"""
+    audio_data = await media_store.get_media(token)
+    if audio_data is None:
+        raise HTTPException(status_code=404, detail="Media not found")
+    return Response(audio_data, media_type="audio/mpeg")
+
+
+@router.get("/setup-pin", response_class=HTMLResponse)
+async def serve_pin_setup(request: Request):
+    """Serve PIN setup page (loaded and gzipped once at startup)"""
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return HTMLResponse(
+            request.app.state.pin_setup_html_gzip,
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+        )
+    return HTMLResponse(request.app.state.pin_setup_html, headers={"Vary": "Accept-Encoding"})
 
-@app.get("/health")
+
+# Health probes hit this every second or so; reuse the serialized body briefly
+HEALTH_CACHE_SECONDS = 1.0
+_health_body = b""
+_health_expires = 0.0
+
+
+@router.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "service": "arcagent-backend",
-    }
\ No newline at end of file
+    global _health_body, _health_expires
+    
+    now = time.monotonic()
+    if now >= _health_expires:
+        _health_body = orjson.dumps({
+            "status": "healthy",
+            "timestamp": datetime.now().isoformat(),
+            "service": "arcagent-backend",
+        })
+        _health_expires = now + HEALTH_CACHE_SECONDS
+    
+    return Response(_health_body, media_type="application/json")
\ No newline at end of file
@@ -0,0 +1,3 @@
+from . import redis_client, address_cache, balance_cache, media_store, pending_payments, user_cache
+
+__all__ = ['redis_client', 'address_cache', 'balance_cache', 'media_store', 'pending_payments', 'user_cache']
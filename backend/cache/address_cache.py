@@ -0,0 +1,23 @@
+from cachetools import TTLCache
+from typing import Optional
+
+# Recipient addresses rarely change; a short in-process TTL covers repeat
+# lookups within a conversation without needing Redis
+ADDRESS_TTL_SECONDS = 5
+
+_addresses: TTLCache = TTLCache(maxsize=10_000, ttl=ADDRESS_TTL_SECONDS)
+
+
+def get_cached_address(identifier: str) -> Optional[str]:
+    """Get cached wallet address for a phone number or user ID"""
+    return _addresses.get(identifier)
+
+
+def cache_address(identifier: str, wallet_address: str) -> None:
+    """Cache a resolved wallet address"""
+    _addresses[identifier] = wallet_address
+
+
+def invalidate_address(identifier: str) -> None:
+    """Drop a cached address (after the user's wallet changes)"""
+    _addresses.pop(identifier, None)
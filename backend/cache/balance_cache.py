@@ -0,0 +1,40 @@
+from redis.exceptions import RedisError
+from typing import Optional
+import logging
+from cache.redis_client import redis as _redis
+
+logger = logging.getLogger(__name__)
+
+# Balances change slowly, so a few seconds of staleness is acceptable
+BALANCE_TTL_SECONDS = 5
+
+
+def _balance_key(wallet_id: str) -> str:
+    return f"bal:{wallet_id}"
+
+
+async def get_cached_balance(wallet_id: str) -> Optional[float]:
+    """Get cached wallet balance (None on miss or if Redis is unreachable)"""
+    try:
+        cached = await _redis.get(_balance_key(wallet_id))
+    except RedisError as e:
+        logger.warning(f"Balance cache read failed: {str(e)}")
+        return None
+    
+    return float(cached) if cached is not None else None
+
+
+async def cache_balance(wallet_id: str, amount: float) -> None:
+    """Store wallet balance with a short TTL"""
+    try:
+        await _redis.setex(_balance_key(wallet_id), BALANCE_TTL_SECONDS, str(amount))
+    except RedisError as e:
+        logger.warning(f"Balance cache write failed: {str(e)}")
+
+
+async def invalidate_balance(wallet_id: str) -> None:
+    """Drop cached balance after the wallet balance changes"""
+    try:
+        await _redis.delete(_balance_key(wallet_id))
+    except RedisError as e:
+        logger.warning(f"Balance cache invalidation failed: {str(e)}")
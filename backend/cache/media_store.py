@@ -0,0 +1,53 @@
+from typing import AsyncIterator, Optional
+import logging
+from cache.redis_client import redis_bytes
+from utils.security import generate_secure_token
+
+logger = logging.getLogger(__name__)
+
+# Twilio fetches the media right after the send; keep it a little longer for retries
+MEDIA_TTL_SECONDS = 600
+
+
+def _media_key(token: str) -> str:
+    return f"media:{token}"
+
+
+async def store_media(data: bytes) -> str:
+    """
+    Store a media blob for Twilio to fetch from /media/{token}
+    
+    Kept in Redis rather than process memory so any API worker can serve it.
+    
+    Returns:
+        Unguessable token for the blob
+    """
+    token = generate_secure_token(16)
+    await redis_bytes.set(_media_key(token), data, ex=MEDIA_TTL_SECONDS)
+    return token
+
+
+async def store_media_stream(chunks: AsyncIterator[bytes]) -> Optional[str]:
+    """
+    Store a media blob chunk by chunk (APPEND keeps the TTL set on the first chunk)
+    
+    Returns:
+        Token for the blob, or None if the stream was empty
+    """
+    token = generate_secure_token(16)
+    key = _media_key(token)
+    stored = False
+    
+    async for chunk in chunks:
+        if stored:
+            await redis_bytes.append(key, chunk)
+        else:
+            await redis_bytes.set(key, chunk, ex=MEDIA_TTL_SECONDS)
+            stored = True
+    
+    return token if stored else None
+
+
+async def get_media(token: str) -> Optional[bytes]:
+    """Get a stored media blob (None if expired or unknown)"""
+    return await redis_bytes.get(_media_key(token))
\ No newline at end of file
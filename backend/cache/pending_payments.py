@@ -0,0 +1,38 @@
+from redis.exceptions import RedisError
+from typing import Optional
+import logging
+from cache.redis_client import redis
+
+logger = logging.getLogger(__name__)
+
+# Matches how long a payment waits for CONFIRM/CANCEL
+PENDING_PAYMENT_TTL_SECONDS = 600
+
+
+def _pending_key(phone_number: str) -> str:
+    return f"pending:{phone_number}"
+
+
+async def set_pending_payment(phone_number: str, workflow_id: str) -> None:
+    """Remember the latest payment workflow awaiting confirmation for a user"""
+    try:
+        await redis.set(_pending_key(phone_number), workflow_id, ex=PENDING_PAYMENT_TTL_SECONDS)
+    except RedisError as e:
+        logger.warning(f"Pending payment write failed: {str(e)}")
+
+
+async def get_pending_payment(phone_number: str) -> Optional[str]:
+    """Get the user's pending payment workflow ID (None on miss or if Redis is unreachable)"""
+    try:
+        return await redis.get(_pending_key(phone_number))
+    except RedisError as e:
+        logger.warning(f"Pending payment read failed: {str(e)}")
+        return None
+
+
+async def clear_pending_payment(phone_number: str) -> None:
+    """Forget the pending payment once it has been confirmed or cancelled"""
+    try:
+        await redis.delete(_pending_key(phone_number))
+    except RedisError as e:
+        logger.warning(f"Pending payment clear failed: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,14 @@
+from redis.asyncio import Redis
+from config import settings
+
+# One connection pool per process, shared by every Redis-backed cache
+redis = Redis.from_url(settings.REDIS_URL, max_connections=50, decode_responses=True)
+
+# Separate small pool for binary values (decode_responses is per pool)
+redis_bytes = Redis.from_url(settings.REDIS_URL, max_connections=10)
+
+
+async def close() -> None:
+    """Close the Redis connection pools"""
+    await redis.aclose()
+    await redis_bytes.aclose()
\ No newline at end of file
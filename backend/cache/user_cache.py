@@ -0,0 +1,66 @@
+from cachetools import TTLCache
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy import select
+from models.database import User, AsyncSessionLocal
+from utils import singleflight
+
+# Payment flows look up the same user several times within a few seconds
+USER_TTL_SECONDS = 30
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """The user fields the API, PIN checks and payment workflow read"""
+    id: str
+    pin_hash: Optional[str]
+    is_verified: bool
+    registration_completed: bool
+    circle_wallet_id: Optional[str]
+    circle_wallet_address: Optional[str]
+    circle_usdc_token_id: Optional[str]
+
+
+_users: TTLCache = TTLCache(maxsize=10_000, ttl=USER_TTL_SECONDS)
+
+
+async def _load_user(phone_number: str) -> Optional[CachedUser]:
+    """Load the cached fields for a user straight from the database"""
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(
+                User.id,
+                User.pin_hash,
+                User.is_verified,
+                User.registration_completed,
+                User.circle_wallet_id,
+                User.circle_wallet_address,
+                User.circle_usdc_token_id
+            ).where(User.whatsapp_number == phone_number)
+        )).first()
+    
+    return CachedUser(*row) if row else None
+
+
+async def get_cached_user(phone_number: str) -> Optional[CachedUser]:
+    """
+    Get user by phone number, served from cache when possible
+    
+    Only users who finished registration are cached; until then their PIN
+    and wallet are still changing.
+    """
+    user = _users.get(phone_number)
+    if user is not None:
+        return user
+    
+    # Concurrent misses for the same phone share one query
+    user = await singleflight.do(f"user:{phone_number}", lambda: _load_user(phone_number))
+    if user is not None and user.registration_completed:
+        _users[phone_number] = user
+    
+    return user
+
+
+def invalidate_user(phone_number: str) -> None:
+    """Drop a cached user (after their PIN or wallet changes)"""
+    _users.pop(phone_number, None)
@@ -23,6 +23,8 @@ class CircleConfig:
                 )
                 # Use production endpoint (testnet keys work here)
                 configuration.host = "https://api.circle.com"
+                # One shared keep-alive pool for every thread using this client
+                configuration.connection_pool_maxsize = 50
                 
                 self.client = ApiClient(configuration)
                 
@@ -0,0 +1,100 @@
+import asyncio
+import httpx
+from typing import Optional
+from config import settings
+
+# One pooled client per upstream, shared by every caller in the process.
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+
+CIRCLE_BASE_URL = "https://api.circle.com/v1/w3s"
+ELEVENLABS_BASE_URL = "https://api.elevenlabs.io/v1"
+
+# Transient upstream statuses retried by request_with_retry (backoff 0.2s, 0.4s)
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+# For non-idempotent POSTs: a gateway error may come after the upstream acted,
+# but a 429 means the request was rejected
+RATE_LIMIT_STATUSES = frozenset({429})
+RETRY_ATTEMPTS = 2
+RETRY_BACKOFF = 0.2
+
+_circle_client: Optional[httpx.AsyncClient] = None
+_twilio_client: Optional[httpx.AsyncClient] = None
+_elevenlabs_client: Optional[httpx.AsyncClient] = None
+
+
+def _timeout(name: str) -> httpx.Timeout:
+    return httpx.Timeout(settings.HTTP_TIMEOUTS.get(name, 10.0))
+
+
+def get_circle_client() -> httpx.AsyncClient:
+    """Get the shared Circle W3S client (HTTP/2, authenticated)"""
+    global _circle_client
+    
+    if _circle_client is None or _circle_client.is_closed:
+        _circle_client = httpx.AsyncClient(
+            base_url=CIRCLE_BASE_URL,
+            # HTTP/2 multiplexes concurrent calls over one TLS connection;
+            # retries=1 re-attempts a failed connect (never a sent request)
+            transport=httpx.AsyncHTTPTransport(http2=True, retries=1, limits=HTTP_LIMITS),
+            headers={
+                "Authorization": f"Bearer {settings.CIRCLE_API_KEY}",
+                "Content-Type": "application/json",
+                "Accept": "application/json"
+            },
+            timeout=_timeout("circle")
+        )
+    return _circle_client
+
+
+def get_twilio_client() -> httpx.AsyncClient:
+    """Get the shared client for Twilio media upload/download (callers pass auth)"""
+    global _twilio_client
+    
+    if _twilio_client is None or _twilio_client.is_closed:
+        _twilio_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(http2=True, retries=1, limits=HTTP_LIMITS),
+            timeout=_timeout("twilio")
+        )
+    return _twilio_client
+
+
+def get_elevenlabs_client() -> httpx.AsyncClient:
+    """Get the shared ElevenLabs client"""
+    global _elevenlabs_client
+    
+    if _elevenlabs_client is None or _elevenlabs_client.is_closed:
+        _elevenlabs_client = httpx.AsyncClient(
+            base_url=ELEVENLABS_BASE_URL,
+            transport=httpx.AsyncHTTPTransport(http2=True, retries=1, limits=HTTP_LIMITS),
+            headers={"xi-api-key": settings.ELEVENLABS_API_KEY},
+            timeout=_timeout("elevenlabs")
+        )
+    return _elevenlabs_client
+
+
+async def request_with_retry(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    retry_statuses: frozenset = RETRY_STATUSES,
+    **kwargs
+) -> httpx.Response:
+    """Send a request, retrying rate-limit/gateway errors (retry_statuses) with backoff"""
+    for attempt in range(RETRY_ATTEMPTS + 1):
+        response = await client.request(method, url, **kwargs)
+        if response.status_code not in retry_statuses or attempt == RETRY_ATTEMPTS:
+            return response
+        await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+    return response
+
+
+async def close_all():
+    """Close every shared client (called on shutdown)"""
+    global _circle_client, _twilio_client, _elevenlabs_client
+    
+    for client in (_circle_client, _twilio_client, _elevenlabs_client):
+        if client is not None:
+            await client.aclose()
+    _circle_client = None
+    _twilio_client = None
+    _elevenlabs_client = None
\ No newline at end of file
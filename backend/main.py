@@ -1,16 +1,28 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from fastapi.staticfiles import StaticFiles
+from pathlib import Path
+import asyncio
+import gzip
 import logging
 
-from api.endpoints import app as api_app
+from api.endpoints import router as api_router
+from api.dependencies import connect_temporal_with_backoff
+from models.database import init_db, warm_up_pool
+from services import circle_service
+from cache import redis_client
+import http_clients
+from utils.log_queue import setup_queue_logging
 
-logging.basicConfig(level=logging.INFO)
+setup_queue_logging(logging.INFO, logging.BASIC_FORMAT)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="ArcAgent Backend API",
     description="AI-powered payment assistant backend",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -21,8 +33,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.mount("/", api_app)
+static_dir = Path("/app/static")
+static_dir.mkdir(parents=True, exist_ok=True)
+app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
+
+app.include_router(api_router)
+
+
+# Initialize database on startup
+@app.on_event("startup")
+async def startup_event():
+    await init_db()
+    logger.info("Database initialized")
+    
+    # Pre-open pooled connections so the first webhooks don't pay for them
+    try:
+        await warm_up_pool()
+    except Exception as e:
+        logger.warning(f"Failed to warm up database pool: {str(e)}")
+    
+    # The PIN setup page is static; keep it in memory
+    app.state.pin_setup_html = (Path(__file__).parent / "pin-setup.html").read_bytes()
+    app.state.pin_setup_html_gzip = gzip.compress(app.state.pin_setup_html)
+    
+    # Open the Circle connection (TLS + HTTP/2) and cache its public key before traffic arrives
+    app.state.circle_client = circle_service.client
+    try:
+        await circle_service.warm_up()
+    except Exception as e:
+        logger.warning(f"Circle warm-up failed: {str(e)}")
+    
+    # Connect to Temporal in the background so /health serves during a cold start
+    app.state.temporal_connect = asyncio.create_task(connect_temporal_with_backoff())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.temporal_connect.cancel()
+    await circle_service.close()
+    await http_clients.close_all()
+    await redis_client.close()
+
 
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    
+    # Workers are separate processes; each runs the startup handler itself and
+    # reads WEB_CONCURRENCY to size its share of the database pool
+    workers = int(os.environ.setdefault("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+        backlog=2048,
+        proxy_headers=True
+    )
@@ -1,3 +1,3 @@
-from .database import Base, User, Transaction, Message, init_db, get_db
+from .database import Base, User, Transaction, Message, IdempotencyKey, init_db, get_db
 
-__all__ = ['Base', 'User', 'Transaction', 'Message', 'init_db', 'get_db']
\ No newline at end of file
+__all__ = ['Base', 'User', 'Transaction', 'Message', 'IdempotencyKey', 'init_db', 'get_db']
\ No newline at end of file
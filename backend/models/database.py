@@ -1,8 +1,10 @@
-from sqlalchemy import create_engine, Column, String, DateTime, Boolean, Float, Integer, Text
+from sqlalchemy import Column, String, DateTime, Boolean, Float, Text, Index, Uuid, Integer, inspect, text, delete
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from datetime import datetime, timedelta
+from typing import AsyncIterator
 from config import settings
+import asyncio
 
 Base = declarative_base()
 
@@ -11,7 +13,7 @@ class User(Base):
     __tablename__ = "users"
     
     id = Column(String, primary_key=True)  # Phone number as ID
-    whatsapp_number = Column(String, unique=True, nullable=False)
+    whatsapp_number = Column(String, nullable=False)
     
     # Registration
     verification_code = Column(String, nullable=True)
@@ -25,6 +27,7 @@ class User(Base):
     # Circle Wallet
     circle_wallet_id = Column(String, nullable=True)
     circle_wallet_address = Column(String, nullable=True)
+    circle_usdc_token_id = Column(String, nullable=True)  # Saved so transfers skip the token lookup
     
     # Status
     registration_completed = Column(Boolean, default=False)
@@ -33,12 +36,31 @@ class User(Base):
     # Timestamps
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        # Unique lookup by phone; INCLUDE holds exactly the columns user_cache._load_user
+        # selects, so that read is index-only
+        Index(
+            "ix_users_whatsapp",
+            "whatsapp_number",
+            unique=True,
+            postgresql_include=[
+                "id",
+                "pin_hash",
+                "is_verified",
+                "registration_completed",
+                "circle_wallet_id",
+                "circle_wallet_address",
+                "circle_usdc_token_id"
+            ]
+        ),
+    )
 
 
 class Transaction(Base):
     __tablename__ = "transactions"
     
-    id = Column(String, primary_key=True)
+    id = Column(Uuid(as_uuid=False), primary_key=True)  # Native 16-byte uuid, still a str in Python
     user_id = Column(String, nullable=False)
     
     # Transaction details
@@ -57,18 +79,25 @@ class Transaction(Base):
     # Timestamps
     created_at = Column(DateTime, default=datetime.utcnow)
     confirmed_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        # History is read newest-first per user; lets LIMIT stop the index scan early
+        Index("ix_tx_user_created_desc", user_id, created_at.desc()),
+        # Pending/confirmed lookups per user, newest first
+        Index("ix_tx_user_status_created", user_id, status, created_at.desc()),
+    )
 
 
 class Message(Base):
     __tablename__ = "messages"
     
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(Uuid(as_uuid=False), primary_key=True)  # Generated by the writer so writes can be batched
     user_id = Column(String, nullable=False)
     
     # Message content
     direction = Column(String, nullable=False)  # inbound, outbound
     message_body = Column(Text, nullable=False)
-    message_sid = Column(String, unique=True)
+    message_sid = Column(String, unique=True, index=True)  # Twilio retries dedupe on this
     
     # Context
     intent = Column(String, nullable=True)  # registration, payment, balance, etc.
@@ -76,22 +105,138 @@ class Message(Base):
     
     # Timestamp
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Conversation history per user, newest first
+        Index("ix_messages_user_created", user_id, created_at.desc()),
+    )
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    
+    # One key per workflow step, reused when Temporal retries the activity
+    workflow_id = Column(String, primary_key=True)
+    step = Column(String, primary_key=True)
+    key = Column(String, nullable=False)
+    
+    # Timestamp
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 
 # Database setup
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Room for every distinct hot statement in the compiled SQL cache
+QUERY_CACHE_SIZE = 1200
+
+# Recycle hourly so connections dropped by the server/proxy are replaced
+POOL_RECYCLE_SECONDS = 3600
+
+# DB_POOL_SIZE / DB_MAX_OVERFLOW budget the whole service; each API worker process gets its share
+POOL_SIZE = max(1, settings.DB_POOL_SIZE // settings.WEB_CONCURRENCY)
+POOL_MAX_OVERFLOW = settings.DB_MAX_OVERFLOW // settings.WEB_CONCURRENCY
+
+# Held while creating/upgrading the schema so concurrent processes don't race
+SCHEMA_LOCK_KEY = 0x617263616765  # "arcage"
+
+# Idempotency keys are only read back by retries of the run that stored them;
+# a week is far longer than any payment or registration run stays open
+IDEMPOTENCY_KEY_RETENTION = timedelta(days=7)
+
+
+def _async_database_url(url: str) -> str:
+    """Use the asyncpg driver for the async engine"""
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
 
 
-def init_db():
-    """Initialize database tables"""
-    Base.metadata.create_all(bind=engine)
+# Async engine with a long-lived connection pool (used by the API and Temporal activities)
+async_engine = create_async_engine(
+    _async_database_url(settings.DATABASE_URL),
+    pool_size=POOL_SIZE,
+    max_overflow=POOL_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=POOL_RECYCLE_SECONDS,
+    pool_use_lifo=True,
+    query_cache_size=QUERY_CACHE_SIZE
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
 
-def get_db():
-    """Dependency for getting database session"""
-    db = SessionLocal()
-    try:
+def _column_type(connection, table: str, column: str):
+    """Current type of a column as the database reports it"""
+    for reflected in inspect(connection).get_columns(table):
+        if reflected["name"] == column:
+            return reflected["type"]
+    return None
+
+
+def _upgrade_schema(connection) -> None:
+    """
+    Bring tables created by older versions up to the current models
+    
+    create_all only creates missing tables and never alters existing ones.
+    Every step checks first, so this is a no-op on a fresh or already
+    upgraded database.
+    """
+    # messages.id was a serial integer before the log writer generated ids
+    if isinstance(_column_type(connection, "messages", "id"), Integer):
+        connection.execute(text("ALTER TABLE messages ALTER COLUMN id DROP DEFAULT"))
+        connection.execute(text("ALTER TABLE messages ALTER COLUMN id TYPE varchar USING gen_random_uuid()::text"))
+        connection.execute(text("DROP SEQUENCE IF EXISTS messages_id_seq"))
+    
+    # Transaction and message ids were stored as varchar before the native uuid type
+    for table in ("transactions", "messages"):
+        if isinstance(_column_type(connection, table, "id"), String):
+            connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN id TYPE uuid USING id::uuid"))
+    
+    # The USDC token id is saved with the wallet so transfers skip the lookup
+    connection.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS circle_usdc_token_id varchar"))
+    
+    # Rebuild ix_users_whatsapp when its INCLUDE list is out of date
+    whatsapp_index = next(index for index in User.__table__.indexes if index.name == "ix_users_whatsapp")
+    include = set(whatsapp_index.dialect_options["postgresql"]["include"])
+    for reflected in inspect(connection).get_indexes("users"):
+        if reflected["name"] == whatsapp_index.name and set(reflected.get("dialect_options", {}).get("postgresql_include", ())) != include:
+            connection.execute(text(f"DROP INDEX {whatsapp_index.name}"))
+    
+    # Indexes declared after their table was first created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    
+    # ix_users_whatsapp enforces uniqueness now; the original constraint is redundant
+    connection.execute(text("ALTER TABLE users DROP CONSTRAINT IF EXISTS users_whatsapp_number_key"))
+    
+    # Same for ix_messages_message_sid, which the message log's ON CONFLICT relies on
+    connection.execute(text("ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_message_sid_key"))
+
+
+async def init_db():
+    """Create missing tables, upgrade existing ones and prune expired idempotency keys"""
+    async with async_engine.begin() as conn:
+        # Every API worker runs this at startup; the first one does the work, the rest
+        # wait here and then find nothing left to do
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_upgrade_schema)
+        
+        # Keys of closed runs are never read again; drop them so the table stays small
+        await conn.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.created_at < datetime.utcnow() - IDEMPOTENCY_KEY_RETENTION)
+        )
+
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """Dependency for getting an async database session"""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
+
+
+async def warm_up_pool():
+    """Open pool_size connections up front so the first activities don't pay for them"""
+    connections = await asyncio.gather(
+        *(async_engine.connect() for _ in range(POOL_SIZE))
+    )
+    for connection in connections:
+        await connection.close()
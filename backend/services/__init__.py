@@ -1,3 +1,5 @@
 from .twilio_service import TwilioService, twilio_service
 from .elevenlabs_service import ElevenLabsService, elevenlabs_service
-__all__ = ['TwilioService', 'twilio_service', 'ElevenLabsService', 'elevenlabs_service']
\ No newline at end of file
+from .circle_service import CircleService, circle_service
+from .balance_batcher import BalanceBatcher, balance_batcher
+__all__ = ['TwilioService', 'twilio_service', 'ElevenLabsService', 'elevenlabs_service', 'CircleService', 'circle_service', 'BalanceBatcher', 'balance_batcher']
\ No newline at end of file
@@ -0,0 +1,61 @@
+import asyncio
+import itertools
+import logging
+from typing import Dict, Any, Optional
+from services.circle_service import circle_service
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceBatcher:
+    """
+    Coalesce concurrent wallet balance lookups
+    
+    Requests arriving within one tick are deduplicated per wallet and sent to
+    Circle together over the shared keep-alive client.
+    """
+    
+    def __init__(self, window: float = 0.02, max_batch: int = 64):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._tick: Optional[asyncio.Task] = None
+    
+    async def get_wallet_balance(self, wallet_id: str) -> Dict[str, Any]:
+        """Get wallet balance, sharing the Circle call with other waiters"""
+        future = self._pending.get(wallet_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[wallet_id] = future
+            
+            if self._tick is None or self._tick.done():
+                self._tick = asyncio.create_task(self._drain())
+        
+        # Shield so one cancelled caller doesn't cancel the lookup for the rest
+        return await asyncio.shield(future)
+    
+    async def _drain(self):
+        """Wait one tick, then issue pending lookups in parallel batches"""
+        await asyncio.sleep(self.window)
+        
+        while self._pending:
+            wallet_ids = list(itertools.islice(self._pending, self.max_batch))
+            futures = [self._pending.pop(wallet_id) for wallet_id in wallet_ids]
+            
+            logger.debug(f"Fetching {len(wallet_ids)} wallet balances")
+            results = await asyncio.gather(
+                *(circle_service.get_wallet_balance(wallet_id) for wallet_id in wallet_ids),
+                return_exceptions=True
+            )
+            
+            for future, result in zip(futures, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+# Singleton instance
+balance_batcher = BalanceBatcher()
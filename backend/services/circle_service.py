@@ -1,154 +1,265 @@
-import requests
+import asyncio
+import httpx
 import logging
 import uuid
 import base64
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import padding, ec
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
+from cryptography.exceptions import InvalidSignature
 from config import settings
+from http_clients import get_circle_client
+from cache.redis_client import redis
+from redis.exceptions import RedisError
 
 logger = logging.getLogger(__name__)
 
+# Each request needs a fresh ciphertext (OAEP is randomized), so a pool of them
+# is encrypted ahead of time in a thread and topped up in the background
+CIPHERTEXT_POOL_SIZE = 64
+
+# Entity public key rarely rotates; one fetch a day serves every process
+PUBLIC_KEY_CACHE_KEY = "circle:pubkey"
+PUBLIC_KEY_TTL_SECONDS = 86400
+
 
 class CircleService:
     """Circle API service for wallet operations"""
     
-    def __init__(self):
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         self.api_key = settings.CIRCLE_API_KEY
         self.entity_secret = settings.CIRCLE_ENTITY_SECRET
-        self.base_url = "https://api.circle.com/v1/w3s"
         self._public_key = None
+        self._notification_keys: Dict[str, Any] = {}
+        self._ciphertext_pool: asyncio.Queue = asyncio.Queue(maxsize=CIPHERTEXT_POOL_SIZE)
+        self._ciphertext_refill: Optional[asyncio.Task] = None
+        # Injected client, or the process-wide one from http_clients
+        self._client = client
         
-    def _get_headers(self) -> Dict[str, str]:
-        """Get common request headers"""
-        return {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the HTTP/2 client (requests multiplex over kept-alive connections)"""
+        if self._client is not None:
+            return self._client
+        return get_circle_client()
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared async client for Circle W3S calls"""
+        return self._get_client()
+    
+    async def warm_up(self):
+        """Open the shared connection, fetch the public key and fill the ciphertext pool"""
+        await self._get_public_key()
+        await self._refill_ciphertext_pool()
     
-    def _get_public_key(self):
-        """Get Circle's public key (cached)"""
+    async def close(self):
+        """Close an injected HTTP client (the shared one is closed by http_clients.close_all)"""
+        if self._client is not None:
+            await self._client.aclose()
+    
+    async def _get_public_key(self):
+        """Get Circle's public key (cached in-process and shared across processes via Redis)"""
         if self._public_key is None:
-            url = "https://api.circle.com/v1/w3s/config/entity/publicKey"
-            response = requests.get(url, headers=self._get_headers())
-            response.raise_for_status()
+            public_key_pem = await self._get_shared_public_key_pem()
+            if public_key_pem is None:
+                url = "/config/entity/publicKey"
+                response = await self._get_client().get(url)
+                response.raise_for_status()
+                
+                public_key_pem = response.json()['data']['publicKey']
+                await self._share_public_key_pem(public_key_pem)
             
-            public_key_pem = response.json()['data']['publicKey']
             self._public_key = serialization.load_pem_public_key(
                 public_key_pem.encode(),
                 backend=default_backend()
             )
         return self._public_key
     
-    def _get_entity_secret_ciphertext(self) -> str:
-        """Encrypt entity secret for this request"""
-        public_key = self._get_public_key()
+    async def _get_shared_public_key_pem(self) -> Optional[str]:
+        """Public key PEM fetched by another worker/pod, if any"""
+        try:
+            return await redis.get(PUBLIC_KEY_CACHE_KEY)
+        except RedisError as e:
+            logger.warning(f"Public key cache read failed: {str(e)}")
+            return None
+    
+    async def _share_public_key_pem(self, public_key_pem: str):
+        """Store the public key PEM so other processes skip the Circle round-trip"""
+        try:
+            await redis.setex(PUBLIC_KEY_CACHE_KEY, PUBLIC_KEY_TTL_SECONDS, public_key_pem)
+        except RedisError as e:
+            logger.warning(f"Public key cache write failed: {str(e)}")
+    
+    def _encrypt_entity_secrets(self, public_key, count: int) -> List[str]:
+        """RSA-OAEP encrypt the entity secret `count` times (CPU-bound, run in a thread)"""
         entity_secret_bytes = bytes.fromhex(self.entity_secret)
-        
-        encrypted = public_key.encrypt(
-            entity_secret_bytes,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None
-            )
+        oaep = padding.OAEP(
+            mgf=padding.MGF1(algorithm=hashes.SHA256()),
+            algorithm=hashes.SHA256(),
+            label=None
         )
+        return [
+            base64.b64encode(public_key.encrypt(entity_secret_bytes, oaep)).decode()
+            for _ in range(count)
+        ]
+    
+    async def _refill_ciphertext_pool(self):
+        """Top the ciphertext pool back up to CIPHERTEXT_POOL_SIZE"""
+        missing = CIPHERTEXT_POOL_SIZE - self._ciphertext_pool.qsize()
+        if missing <= 0:
+            return
+        
+        public_key = await self._get_public_key()
+        ciphertexts = await asyncio.to_thread(self._encrypt_entity_secrets, public_key, missing)
+        for ciphertext in ciphertexts:
+            if self._ciphertext_pool.full():
+                break
+            self._ciphertext_pool.put_nowait(ciphertext)
+    
+    async def _get_entity_secret_ciphertext(self) -> str:
+        """Take a fresh entity secret ciphertext for this request (each one is used once)"""
+        if self._ciphertext_refill is None or self._ciphertext_refill.done():
+            if self._ciphertext_pool.qsize() < CIPHERTEXT_POOL_SIZE // 2:
+                self._ciphertext_refill = asyncio.create_task(self._refill_ciphertext_pool())
         
-        return base64.b64encode(encrypted).decode()
+        try:
+            return self._ciphertext_pool.get_nowait()
+        except asyncio.QueueEmpty:
+            # Pool drained (cold start or burst): encrypt one for this request
+            public_key = await self._get_public_key()
+            return (await asyncio.to_thread(self._encrypt_entity_secrets, public_key, 1))[0]
+    
+    async def _get_notification_public_key(self, key_id: str):
+        """Get the public key Circle signs webhook notifications with (cached)"""
+        if key_id not in self._notification_keys:
+            url = f"https://api.circle.com/v2/notifications/publicKey/{key_id}"
+            response = await self._get_client().get(url)
+            response.raise_for_status()
+            
+            public_key_der = base64.b64decode(response.json()['data']['publicKey'])
+            self._notification_keys[key_id] = serialization.load_der_public_key(
+                public_key_der,
+                backend=default_backend()
+            )
+        return self._notification_keys[key_id]
+    
+    async def verify_notification(self, body: bytes, key_id: str, signature: str) -> bool:
+        """Verify the signature of a Circle webhook notification"""
+        public_key = await self._get_notification_public_key(key_id)
+        try:
+            public_key.verify(base64.b64decode(signature), body, ec.ECDSA(hashes.SHA256()))
+            return True
+        except InvalidSignature:
+            return False
     
-    def create_wallet_set(self, name: str) -> Dict[str, Any]:
+    async def create_wallet_set(self, name: str, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
         """Create a wallet set"""
-        url = f"{self.base_url}/developer/walletSets"
+        url = "/developer/walletSets"
         payload = {
-            "idempotencyKey": str(uuid.uuid4()),
-            "entitySecretCiphertext": self._get_entity_secret_ciphertext(),
+            "idempotencyKey": idempotency_key or str(uuid.uuid4()),
+            "entitySecretCiphertext": await self._get_entity_secret_ciphertext(),
             "name": name
         }
         
-        response = requests.post(url, headers=self._get_headers(), json=payload)
+        response = await self._get_client().post(url, json=payload)
         response.raise_for_status()
         return response.json()
     
-    def create_wallet(self, wallet_set_id: str, blockchain: str = "ARC-TESTNET") -> Dict[str, Any]:
+    async def create_wallet(
+        self,
+        wallet_set_id: str,
+        blockchain: str = "ARC-TESTNET",
+        idempotency_key: Optional[str] = None
+    ) -> Dict[str, Any]:
         """Create a wallet on specified blockchain"""
-        url = f"{self.base_url}/developer/wallets"
+        url = "/developer/wallets"
         payload = {
-            "idempotencyKey": str(uuid.uuid4()),
-            "entitySecretCiphertext": self._get_entity_secret_ciphertext(),
+            "idempotencyKey": idempotency_key or str(uuid.uuid4()),
+            "entitySecretCiphertext": await self._get_entity_secret_ciphertext(),
             "accountType": "SCA",
             "blockchains": [blockchain],
             "count": 1,
             "walletSetId": wallet_set_id
         }
         
-        response = requests.post(url, headers=self._get_headers(), json=payload)
+        response = await self._get_client().post(url, json=payload)
         response.raise_for_status()
         return response.json()
     
-    def get_wallet_balance(self, wallet_id: str) -> Dict[str, Any]:
+    async def get_wallet_balance(self, wallet_id: str) -> Dict[str, Any]:
         """Get wallet balance"""
-        url = f"{self.base_url}/wallets/{wallet_id}/balances"
-        response = requests.get(url, headers=self._get_headers())
+        url = f"/wallets/{wallet_id}/balances"
+        response = await self._get_client().get(url)
         response.raise_for_status()
         return response.json()
     
-    def create_user_wallet(self, user_id: str) -> Dict[str, str]:
-        """Create complete wallet for user"""
-        wallet_set_response = self.create_wallet_set(f"ArcAgent-{user_id}")
-        wallet_set_id = wallet_set_response['data']['walletSet']['id']
+    async def create_user_wallet(
+        self,
+        user_id: str,
+        wallet_set_id: Optional[str] = None,
+        idempotency_key: Optional[str] = None
+    ) -> Dict[str, str]:
+        """Create complete wallet for user (reuses wallet set if one is given)"""
+        if wallet_set_id is None:
+            wallet_set_response = await self.create_wallet_set(f"ArcAgent-{user_id}")
+            wallet_set_id = wallet_set_response['data']['walletSet']['id']
         
-        wallet_response = self.create_wallet(wallet_set_id, "ARC-TESTNET")
+        wallet_response = await self.create_wallet(wallet_set_id, "ARC-TESTNET", idempotency_key)
         wallet = wallet_response['data']['wallets'][0]
         
         return {
             "wallet_id": wallet['id'],
-            "wallet_address": wallet['address']
+            "wallet_address": wallet['address'],
+            "wallet_set_id": wallet_set_id
         }
     
-    def create_transaction_transfer(
+    async def create_transaction_transfer(
         self,
         wallet_id: str,
         token_id: str,
         destination_address: str,
-        amount: str
+        amount: str,
+        ref_id: Optional[str] = None,
+        idempotency_key: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Create a transfer transaction"""
-        url = f"{self.base_url}/developer/transactions/transfer"
+        """Create a transfer transaction (ref_id is echoed back in webhook notifications)"""
+        url = "/developer/transactions/transfer"
         payload = {
-            "idempotencyKey": str(uuid.uuid4()),
-            "entitySecretCiphertext": self._get_entity_secret_ciphertext(),
+            "idempotencyKey": idempotency_key or str(uuid.uuid4()),
+            "entitySecretCiphertext": await self._get_entity_secret_ciphertext(),
             "walletId": wallet_id,
             "tokenId": token_id,
             "destinationAddress": destination_address,
             "amounts": [amount],
             "feeLevel": "MEDIUM"
         }
+        if ref_id:
+            payload["refId"] = ref_id
         
         logger.info(f"Transfer request payload (without secret): walletId={wallet_id}, tokenId={token_id}, destinationAddress={destination_address}, amounts={[amount]}")
         
-        response = requests.post(url, headers=self._get_headers(), json=payload)
+        response = await self._get_client().post(url, json=payload)
         
-        if not response.ok:
+        if not response.is_success:
             logger.error(f"Transfer failed: {response.status_code}")
             logger.error(f"Response body: {response.text}")
         
         response.raise_for_status()
         return response.json()
     
-    def get_transaction(self, transaction_id: str) -> Dict[str, Any]:
+    async def get_transaction(self, transaction_id: str) -> Dict[str, Any]:
         """Get transaction status"""
-        url = f"{self.base_url}/transactions/{transaction_id}"
-        response = requests.get(url, headers=self._get_headers())
+        url = f"/transactions/{transaction_id}"
+        response = await self._get_client().get(url)
         response.raise_for_status()
         return response.json()
     
     # def get_token_id(self, blockchain: str = "ARC-TESTNET") -> Optional[str]:
     #     """Get USDC token ID for blockchain"""
-    #     url = f"{self.base_url}/tokens"
-    #     response = requests.get(url, headers=self._get_headers())
+    #     url = "/tokens"
+    #     response = await self._get_client().get(url)
     #     response.raise_for_status()
         
     #     tokens = response.json()['data']['tokens']
@@ -1,10 +1,53 @@
-import requests
 import logging
-from typing import Optional
+import secrets
+from types import MappingProxyType
+from typing import AsyncIterator, Dict, Optional
 from config import settings
+from http_clients import get_twilio_client, get_elevenlabs_client, request_with_retry
 
 logger = logging.getLogger(__name__)
 
+# Map content types to upload filenames
+_MIME_TO_EXT = MappingProxyType({
+    'audio/ogg': ('audio.ogg', 'audio/ogg'),
+    'audio/mpeg': ('audio.mp3', 'audio/mpeg'),
+    'audio/mp4': ('audio.mp4', 'audio/mp4'),
+    'audio/wav': ('audio.wav', 'audio/wav'),
+    'audio/webm': ('audio.webm', 'audio/webm'),
+})
+
+# Chunk size for streamed TTS audio
+TTS_STREAM_CHUNK_SIZE = 16384
+
+# Invariant part of every TTS request body (never mutated)
+_TTS_MODEL_ID = "eleven_multilingual_v2"
+_TTS_VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.75
+}
+
+
+async def _stream_multipart(
+    boundary: str,
+    fields: Dict[str, str],
+    file_field: str,
+    filename: str,
+    mime: str,
+    chunks: AsyncIterator[bytes]
+) -> AsyncIterator[bytes]:
+    """Encode a multipart/form-data body, passing the file's chunks through as they arrive"""
+    for name, value in fields.items():
+        yield (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        ).encode()
+    yield (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+        f'Content-Type: {mime}\r\n\r\n'
+    ).encode()
+    async for chunk in chunks:
+        yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
 
 class ElevenLabsService:
     """Eleven Labs API service for STT and TTS"""
@@ -12,19 +55,13 @@ class ElevenLabsService:
     def __init__(self):
         self.api_key = settings.ELEVENLABS_API_KEY
         self.voice_id = settings.ELEVENLABS_VOICE_ID
-        self.base_url = "https://api.elevenlabs.io/v1"
         self.enabled = self.api_key is not None
+        self._tts_url = f"/text-to-speech/{self.voice_id}"
         
         if not self.enabled:
             logger.warning("Eleven Labs API key not configured. Audio features disabled.")
     
-    def _get_headers(self) -> dict:
-        """Get common request headers"""
-        return {
-            "xi-api-key": self.api_key,
-        }
-    
-    def transcribe_audio(self, audio_url: str) -> Optional[str]:
+    async def transcribe_audio(self, audio_url: str) -> Optional[str]:
         """
         Transcribe audio from URL using Eleven Labs STT
         
@@ -39,53 +76,47 @@ class ElevenLabsService:
             return None
             
         try:
-            # Download audio from Twilio URL
+            # Stream the audio from Twilio straight into the STT upload; the
+            # voice note is never held in memory as a whole
             logger.info(f"Downloading audio from: {audio_url}")
-            audio_response = requests.get(audio_url, auth=(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN))
-            audio_response.raise_for_status()
-            audio_data = audio_response.content
-            
-            logger.info(f"Downloaded audio: {len(audio_data)} bytes, content-type: {audio_response.headers.get('content-type')}")
-            
-            # Determine the correct mime type
-            content_type = audio_response.headers.get('content-type', 'audio/ogg')
-            
-            # Map content types to file extensions
-            mime_to_ext = {
-                'audio/ogg': ('audio.ogg', 'audio/ogg'),
-                'audio/mpeg': ('audio.mp3', 'audio/mpeg'),
-                'audio/mp4': ('audio.mp4', 'audio/mp4'),
-                'audio/wav': ('audio.wav', 'audio/wav'),
-                'audio/webm': ('audio.webm', 'audio/webm'),
-            }
-            
-            filename, mime = mime_to_ext.get(content_type, ('audio.ogg', content_type))
-            
-            # Call Eleven Labs STT API with required parameters
-            url = f"{self.base_url}/speech-to-text"
-            
-            # Prepare multipart form data - parameter must be named 'file'
-            files = {
-                'file': (filename, audio_data, mime)
-            }
-            
-            # Add required form fields
-            data = {
-                'model_id': 'scribe_v1',  # Required: only scribe_v1 is supported
-            }
-            
-            headers = self._get_headers()
-            
-            logger.info(f"Sending to Eleven Labs STT with model: scribe_v1, filename: {filename}")
-            
-            response = requests.post(
-                url,
-                headers=headers,
-                files=files,
-                data=data
-            )
-            
-            if not response.ok:
+            async with get_twilio_client().stream(
+                "GET",
+                audio_url,
+                auth=(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN),
+                follow_redirects=True
+            ) as audio_response:
+                audio_response.raise_for_status()
+                
+                logger.info(f"Downloading audio: {audio_response.headers.get('content-length', '?')} bytes, content-type: {audio_response.headers.get('content-type')}")
+                
+                # Determine the correct mime type
+                content_type = audio_response.headers.get('content-type', 'audio/ogg')
+                
+                filename, mime = _MIME_TO_EXT.get(content_type, ('audio.ogg', content_type))
+                
+                # Call Eleven Labs STT API with required parameters
+                url = "/speech-to-text"
+                
+                # Multipart form: model_id (required: only scribe_v1 is supported) and 'file'
+                boundary = secrets.token_hex(16)
+                body = _stream_multipart(
+                    boundary,
+                    {'model_id': 'scribe_v1'},
+                    'file',
+                    filename,
+                    mime,
+                    audio_response.aiter_bytes()
+                )
+                
+                logger.info(f"Sending to Eleven Labs STT with model: scribe_v1, filename: {filename}")
+                
+                response = await get_elevenlabs_client().post(
+                    url,
+                    content=body,
+                    headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+                )
+            
+            if not response.is_success:
                 logger.error(f"Eleven Labs STT error: {response.status_code} - {response.text}")
                 response.raise_for_status()
             
@@ -111,7 +142,7 @@ class ElevenLabsService:
             logger.exception(e)
             return None
     
-    def generate_speech(self, text: str) -> Optional[bytes]:
+    async def generate_speech(self, text: str) -> Optional[bytes]:
         """
         Generate speech from text using Eleven Labs TTS
         
@@ -126,25 +157,13 @@ class ElevenLabsService:
             return None
             
         try:
-            url = f"{self.base_url}/text-to-speech/{self.voice_id}"
-            
             payload = {
                 "text": text,
-                "model_id": "eleven_multilingual_v2",
-                "voice_settings": {
-                    "stability": 0.5,
-                    "similarity_boost": 0.75
-                }
+                "model_id": _TTS_MODEL_ID,
+                "voice_settings": _TTS_VOICE_SETTINGS
             }
             
-            response = requests.post(
-                url,
-                headers={
-                    **self._get_headers(),
-                    "Content-Type": "application/json"
-                },
-                json=payload
-            )
+            response = await request_with_retry(get_elevenlabs_client(), "POST", self._tts_url, json=payload)
             response.raise_for_status()
             
             audio_data = response.content
@@ -154,6 +173,38 @@ class ElevenLabsService:
         except Exception as e:
             logger.error(f"Failed to generate speech: {str(e)}")
             return None
+    
+    async def generate_speech_stream(self, text: str) -> AsyncIterator[bytes]:
+        """
+        Generate speech from text, yielding MP3 chunks as ElevenLabs renders them
+        
+        Uses the streaming TTS endpoint so the clip is never held in memory
+        as a whole. Yields nothing if TTS is not configured; errors raise.
+        
+        Args:
+            text: Text to convert to speech
+            
+        Yields:
+            Audio data chunks
+        """
+        if not self.enabled:
+            logger.error("Eleven Labs not configured")
+            return
+        
+        payload = {
+            "text": text,
+            "model_id": _TTS_MODEL_ID,
+            "voice_settings": _TTS_VOICE_SETTINGS
+        }
+        
+        size = 0
+        async with get_elevenlabs_client().stream("POST", f"{self._tts_url}/stream", json=payload) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(TTS_STREAM_CHUNK_SIZE):
+                size += len(chunk)
+                yield chunk
+        
+        logger.info(f"Streamed speech audio ({size} bytes)")
 
 
 elevenlabs_service = ElevenLabsService()
\ No newline at end of file
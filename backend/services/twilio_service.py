@@ -1,21 +1,78 @@
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+from requests.adapters import HTTPAdapter
 from config import settings
+from types import MappingProxyType
 from typing import Optional
+import asyncio
+import orjson
 import logging
-import requests
+from http_clients import get_twilio_client, request_with_retry, RATE_LIMIT_STATUSES
+from cache import media_store
 
 logger = logging.getLogger(__name__)
 
+# Kept-alive connections to the Twilio API (requests keeps only 10 by default,
+# fewer than the sends the activities run at once)
+TWILIO_POOL_SIZE = 20
+
+TWILIO_API_URL = "https://api.twilio.com/2010-04-01"
+
+# Canned message bodies; only the placeholders are filled in per send
+_VERIFICATION_PREFIX = "🔐 Your ArcAgent verification code is: "
+_VERIFICATION_SUFFIX = "\n\nThis code expires in 10 minutes."
+
+_WELCOME_BODY = """Welcome{name_suffix} to ArcAgent! 🚀
+
+Your wallet is ready! Here's what you can do:
+
+💸 Send money: "Send $20 to John"
+💰 Check balance: "Balance" or "How much do I have?"
+📊 View history: "Show transactions"
+
+Need help? Just type "Help"
+        """
+
+_CONFIRM_PAYMENT_BODY = "💸 You want to send ${amount:.2f} to {recipient}.\n\nReply CONFIRM to proceed or CANCEL to abort."
+_CONFIRM_ACTION_BODY = "⚠️ Confirm action: {action}\n\nReply CONFIRM to proceed or CANCEL to abort."
+
+_RECEIPT_BODY = """✅ Payment Successful!
+
+Amount: ${amount:.2f}
+To: {recipient}
+Tx Hash: {tx_start}...{tx_end}
+Time: {timestamp}
+
+View on explorer:
+https://testnet.arcscan.app/tx/{tx_hash}
+
+Your balance has been updated.
+        """
+
+_ERROR_MESSAGES = MappingProxyType({
+    "insufficient_funds": "❌ Insufficient funds. Please check your balance and try again.",
+    "invalid_recipient": "❌ Invalid recipient. Please check the name or number and try again.",
+    "invalid_amount": "❌ Invalid amount. Please enter a valid dollar amount.",
+    "general": "❌ Something went wrong. Please try again or contact support.",
+    "rate_limit": "⏳ Too many requests. Please wait a moment and try again."
+})
+
 
 class TwilioService:
     def __init__(self):
+        # The SDK client is only used for media sends; text goes over REST below
+        http_client = TwilioHttpClient(timeout=settings.HTTP_TIMEOUTS.get("twilio"))
+        http_client.session.mount("https://", HTTPAdapter(pool_maxsize=TWILIO_POOL_SIZE))
         self.client = Client(
             settings.TWILIO_ACCOUNT_SID,
-            settings.TWILIO_AUTH_TOKEN
+            settings.TWILIO_AUTH_TOKEN,
+            http_client=http_client
         )
         self.from_number = settings.TWILIO_WHATSAPP_NUMBER
+        self._auth = (settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+        self._messages_url = f"{TWILIO_API_URL}/Accounts/{settings.TWILIO_ACCOUNT_SID}/Messages.json"
     
-    def send_message(
+    async def send_message(
         self,
         to: str,
         body: str,
@@ -23,7 +80,10 @@ class TwilioService:
         content_variables: Optional[dict] = None
     ) -> str:
         """
-        Send WhatsApp message via Twilio
+        Send WhatsApp message via the Twilio Messages REST endpoint
+        
+        Posts directly on the shared async client rather than through the
+        blocking SDK, so sends don't need a thread each.
         
         Args:
             to: Recipient WhatsApp number (format: whatsapp:+1234567890)
@@ -40,49 +100,48 @@ class TwilioService:
                 to = f'whatsapp:{to}'
             
             message_params = {
-                'from_': self.from_number,
-                'to': to,
+                'From': self.from_number,
+                'To': to,
             }
             
             # Use content template if provided
             if content_sid:
-                message_params['content_sid'] = content_sid
+                message_params['ContentSid'] = content_sid
                 if content_variables:
-                    import json
-                    message_params['content_variables'] = json.dumps(content_variables)
+                    message_params['ContentVariables'] = orjson.dumps(content_variables).decode()
             else:
-                message_params['body'] = body
+                message_params['Body'] = body
             
-            message = self.client.messages.create(**message_params)
+            # Creating a message isn't idempotent: retrying a gateway error could
+            # deliver it twice, so only rate-limit rejections are retried
+            response = await request_with_retry(
+                get_twilio_client(),
+                "POST",
+                self._messages_url,
+                retry_statuses=RATE_LIMIT_STATUSES,
+                auth=self._auth,
+                data=message_params
+            )
+            response.raise_for_status()
+            message_sid = response.json()['sid']
             
-            logger.info(f"Message sent to {to}: {message.sid}")
-            return message.sid
+            logger.info(f"Message sent to {to}: {message_sid}")
+            return message_sid
             
         except Exception as e:
             logger.error(f"Failed to send message to {to}: {str(e)}")
             raise
     
-    def send_verification_code(self, to: str, code: str) -> str:
+    async def send_verification_code(self, to: str, code: str) -> str:
         """Send verification code message"""
-        body = f"🔐 Your ArcAgent verification code is: {code}\n\nThis code expires in 10 minutes."
-        return self.send_message(to, body)
+        return await self.send_message(to, _VERIFICATION_PREFIX + code + _VERIFICATION_SUFFIX)
     
-    def send_welcome_message(self, to: str, user_name: Optional[str] = None) -> str:
+    async def send_welcome_message(self, to: str, user_name: Optional[str] = None) -> str:
         """Send welcome message after registration"""
-        greeting = f"Welcome{' ' + user_name if user_name else ''} to ArcAgent! 🚀"
-        body = f"""{greeting}
-
-Your wallet is ready! Here's what you can do:
-
-💸 Send money: "Send $20 to John"
-💰 Check balance: "Balance" or "How much do I have?"
-📊 View history: "Show transactions"
-
-Need help? Just type "Help"
-        """
-        return self.send_message(to, body)
+        body = _WELCOME_BODY.format_map({"name_suffix": f" {user_name}" if user_name else ""})
+        return await self.send_message(to, body)
     
-    def send_confirmation_request(
+    async def send_confirmation_request(
         self,
         to: str,
         action: str,
@@ -91,13 +150,13 @@ Need help? Just type "Help"
     ) -> str:
         """Request user confirmation for an action"""
         if amount and recipient:
-            body = f"💸 You want to send ${amount:.2f} to {recipient}.\n\nReply CONFIRM to proceed or CANCEL to abort."
+            body = _CONFIRM_PAYMENT_BODY.format_map({"amount": amount, "recipient": recipient})
         else:
-            body = f"⚠️ Confirm action: {action}\n\nReply CONFIRM to proceed or CANCEL to abort."
+            body = _CONFIRM_ACTION_BODY.format_map({"action": action})
         
-        return self.send_message(to, body)
+        return await self.send_message(to, body)
     
-    def send_transaction_receipt(
+    async def send_transaction_receipt(
         self,
         to: str,
         amount: float,
@@ -106,36 +165,22 @@ Need help? Just type "Help"
         timestamp: str
     ) -> str:
         """Send transaction receipt"""
-        explorer_url = f"https://testnet.arcscan.app/tx/{tx_hash}"
-        
-        body = f"""✅ Payment Successful!
-
-Amount: ${amount:.2f}
-To: {recipient}
-Tx Hash: {tx_hash[:10]}...{tx_hash[-8:]}
-Time: {timestamp}
-
-View on explorer:
-{explorer_url}
-
-Your balance has been updated.
-        """
-        return self.send_message(to, body)
+        body = _RECEIPT_BODY.format_map({
+            "amount": amount,
+            "recipient": recipient,
+            "tx_hash": tx_hash,
+            "tx_start": tx_hash[:10],
+            "tx_end": tx_hash[-8:],
+            "timestamp": timestamp
+        })
+        return await self.send_message(to, body)
     
-    def send_error_message(self, to: str, error_type: str = "general") -> str:
+    async def send_error_message(self, to: str, error_type: str = "general") -> str:
         """Send error message"""
-        error_messages = {
-            "insufficient_funds": "❌ Insufficient funds. Please check your balance and try again.",
-            "invalid_recipient": "❌ Invalid recipient. Please check the name or number and try again.",
-            "invalid_amount": "❌ Invalid amount. Please enter a valid dollar amount.",
-            "general": "❌ Something went wrong. Please try again or contact support.",
-            "rate_limit": "⏳ Too many requests. Please wait a moment and try again."
-        }
-        
-        body = error_messages.get(error_type, error_messages["general"])
-        return self.send_message(to, body)
+        body = _ERROR_MESSAGES.get(error_type, _ERROR_MESSAGES["general"])
+        return await self.send_message(to, body)
     
-    def upload_media_to_twilio(self, audio_data: bytes, filename: str = "audio.mp3") -> str:
+    async def upload_media_to_twilio(self, audio_data: bytes, filename: str = "audio.mp3") -> str:
         """
         Upload media to Twilio and get public URL
         
@@ -154,7 +199,7 @@ Your balance has been updated.
                 'MediaFile': (filename, audio_data, 'audio/mpeg')
             }
             
-            response = requests.post(
+            response = await get_twilio_client().post(
                 url,
                 auth=(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN),
                 files=files
@@ -173,7 +218,7 @@ Your balance has been updated.
             logger.error(f"Failed to upload media to Twilio: {str(e)}")
             raise
     
-    def send_audio_message(self, to: str, audio_data: bytes) -> str:
+    async def send_audio_message(self, to: str, audio_data: bytes) -> str:
         """
         Send audio message via WhatsApp
         
@@ -181,6 +226,21 @@ Your balance has been updated.
             to: Recipient WhatsApp number
             audio_data: Audio file data as bytes
             
+        Returns:
+            Message SID
+        """
+        # Serve the clip from our own /media route instead of a third-party host
+        token = await media_store.store_media(audio_data)
+        return await self.send_stored_audio(to, token)
+    
+    async def send_stored_audio(self, to: str, token: str) -> str:
+        """
+        Send an audio clip already saved in the media store
+        
+        Args:
+            to: Recipient WhatsApp number
+            token: Media store token of the clip
+            
         Returns:
             Message SID
         """
@@ -189,44 +249,22 @@ Your balance has been updated.
             if not to.startswith('whatsapp:'):
                 to = f'whatsapp:{to}'
             
-            # Method 1: Try uploading to a temporary public storage service
-            # For now, we'll use tmpfiles.org which provides temporary public URLs
+            media_url = f"{settings.BACKEND_PUBLIC_URL}/media/{token}"
             
-            logger.info(f"Uploading audio to temporary storage...")
-            
-            # Upload to tmpfiles.org (free temporary file hosting)
-            upload_response = requests.post(
-                'https://tmpfiles.org/api/v1/upload',
-                files={'file': ('audio.mp3', audio_data, 'audio/mpeg')}
+            # Send message with media (the SDK is blocking)
+            message = await asyncio.to_thread(
+                self.client.messages.create,
+                from_=self.from_number,
+                to=to,
+                media_url=[media_url]
             )
             
-            if upload_response.status_code == 200:
-                result = upload_response.json()
-                if result.get('status') == 'success':
-                    # Get the URL and convert it to direct link
-                    file_url = result['data']['url']
-                    # Convert https://tmpfiles.org/12345 to https://tmpfiles.org/dl/12345
-                    direct_url = file_url.replace('tmpfiles.org/', 'tmpfiles.org/dl/')
-                    
-                    logger.info(f"Audio uploaded to: {direct_url}")
-                    
-                    # Send message with media
-                    message = self.client.messages.create(
-                        from_=self.from_number,
-                        to=to,
-                        media_url=[direct_url]
-                    )
-                    
-                    logger.info(f"Audio message sent to {to}: {message.sid}")
-                    return message.sid
-            
-            # If tmpfiles fails, raise exception
-            raise Exception("Failed to upload audio to temporary storage")
+            logger.info(f"Audio message sent to {to}: {message.sid}")
+            return message.sid
             
         except Exception as e:
             logger.error(f"Failed to send audio message to {to}: {str(e)}")
             raise
 
-
 # Singleton instance
 twilio_service = TwilioService()
\ No newline at end of file
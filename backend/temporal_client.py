@@ -0,0 +1,126 @@
+import asyncio
+import dataclasses
+import logging
+import random
+from typing import Any, Optional, Type
+import orjson
+from temporalio.api.common.v1 import Payload
+from temporalio.client import Client
+from temporalio.converter import (
+    CompositePayloadConverter,
+    DataConverter,
+    DefaultPayloadConverter,
+    JSONPlainPayloadConverter,
+    value_to_type,
+)
+from temporalio.service import KeepAliveConfig
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# One Temporal client (gRPC channel) per process, shared by the API and every worker.
+# Keep-alive pings hold the channel open so calls never pay for a new handshake.
+KEEP_ALIVE = KeepAliveConfig(interval_millis=30_000, timeout_millis=15_000)
+
+# Reconnect backoff (seconds): base * 2**attempt capped at max, scaled by a random
+# 0.5-1.5x so workers restarting together don't reconnect in lockstep
+RETRY_BASE = 1.0
+RETRY_MAX = 30.0
+
+
+
+def _orjson_default(value: Any) -> Any:
+    """Fallbacks matching the SDK's JSON encoder (orjson handles dataclasses itself)"""
+    if hasattr(value, "dict"):
+        return value.dict()
+    if hasattr(value, "__iter__"):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class OrjsonPayloadConverter(JSONPlainPayloadConverter):
+    """
+    json/plain payloads encoded and decoded with orjson
+    
+    Any json/plain decoder can read these payloads. The bytes differ from
+    the SDK's encoder in one way: dataclass fields keep declaration order,
+    because OPT_SORT_KEYS only sorts dict keys. Non-str dict keys are
+    stringified like the stdlib encoder does (OPT_NON_STR_KEYS).
+    """
+    
+    def to_payload(self, value: Any) -> Optional[Payload]:
+        return Payload(
+            metadata={"encoding": b"json/plain"},
+            data=orjson.dumps(value, default=_orjson_default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        )
+    
+    def from_payload(self, payload: Payload, type_hint: Optional[Type] = None) -> Any:
+        try:
+            obj = orjson.loads(payload.data)
+        except orjson.JSONDecodeError as err:
+            raise RuntimeError("Failed parsing") from err
+        if type_hint:
+            obj = value_to_type(type_hint, obj)
+        return obj
+
+
+class OrjsonDefaultPayloadConverter(CompositePayloadConverter):
+    """The SDK's default converter chain with the JSON step swapped for orjson"""
+    
+    def __init__(self) -> None:
+        super().__init__(*(
+            OrjsonPayloadConverter() if isinstance(converter, JSONPlainPayloadConverter) else converter
+            for converter in DefaultPayloadConverter.default_encoding_payload_converters
+        ))
+
+
+DATA_CONVERTER = dataclasses.replace(DataConverter.default, payload_converter_class=OrjsonDefaultPayloadConverter)
+
+_client: Optional[Client] = None
+_lock = asyncio.Lock()
+
+
+def current_client() -> Optional[Client]:
+    """The shared client if it's connected, without connecting"""
+    return _client
+
+
+async def get_client() -> Client:
+    """Get the shared Temporal client, connecting on first use"""
+    global _client
+    
+    if _client is None:
+        async with _lock:
+            if _client is None:
+                _client = await Client.connect(
+                    settings.TEMPORAL_HOST,
+                    namespace=settings.TEMPORAL_NAMESPACE,
+                    data_converter=DATA_CONVERTER,
+                    keep_alive_config=KEEP_ALIVE
+                )
+                logger.info(f"Connected to Temporal at {settings.TEMPORAL_HOST}")
+    return _client
+
+
+async def connect_with_backoff(max_attempts: Optional[int] = None) -> Client:
+    """
+    Connect the shared client, retrying with exponential backoff and jitter
+    
+    Args:
+        max_attempts: Give up (re-raising the last error) after this many tries; None retries forever
+    
+    Returns:
+        The shared client
+    """
+    attempt = 0
+    while True:
+        try:
+            return await get_client()
+        except Exception as e:
+            attempt += 1
+            if max_attempts is not None and attempt >= max_attempts:
+                logger.error(f"Could not connect to Temporal after {attempt} attempts")
+                raise
+            retry_delay = min(RETRY_MAX, RETRY_BASE * 2 ** (attempt - 1)) * (0.5 + random.random())
+            logger.warning(f"Temporal not reachable ({str(e)}), retrying in {retry_delay:.1f}s")
+            await asyncio.sleep(retry_delay)
\ No newline at end of file
@@ -0,0 +1,72 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+# Put by close(); the drain loop writes what it has collected and stops
+_STOP = object()
+
+
+class BatchQueue:
+    """
+    Queue whose items are handed to a writer in batches by a background task
+
+    The task starts on the first put (and restarts if it ever died). It waits
+    for an item, keeps collecting until max_batch items or interval seconds,
+    then awaits write(batch). write is expected to handle its own errors.
+    With interval=0 nothing waits: a batch is whatever was already queued.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[list], Awaitable[None]],
+        max_batch: int,
+        interval: float,
+        maxsize: int = 10_000
+    ):
+        self._write = write
+        self._max_batch = max_batch
+        self._interval = interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._task: Optional[asyncio.Task] = None
+
+    async def put(self, item: Any) -> None:
+        """Queue an item (waits while the queue is full)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+        await self._queue.put(item)
+
+    async def close(self) -> None:
+        """Write any queued items and stop the background task (called on shutdown)"""
+        if self._task is not None and not self._task.done():
+            await self._queue.put(_STOP)
+            await self._task
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            
+            batch = [item]
+            deadline = loop.time() + self._interval
+            stop = False
+            
+            while len(batch) < self._max_batch:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout > 0:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            await self._write(batch)
+            
+            if stop:
+                return
\ No newline at end of file
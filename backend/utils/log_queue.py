@@ -0,0 +1,35 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def setup_queue_logging(level: int = logging.INFO, fmt: str = DEFAULT_FORMAT) -> QueueListener:
+    """
+    Configure root logging so callers only enqueue records
+    
+    Formatting (timestamps included) and the write to stderr happen on the
+    listener's thread, off the event loop. The listener is flushed at exit.
+    
+    Args:
+        level: Root log level
+        fmt: Format string for the stderr handler
+    
+    Returns:
+        The running listener
+    """
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(fmt))
+    
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(log_queue)]
+    root.setLevel(level)
+    
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
\ No newline at end of file
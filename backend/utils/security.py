@@ -1,19 +1,44 @@
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
+import base64
+import functools
 import secrets
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Initialize Argon2 hasher with secure parameters
+# Initialize Argon2 hasher with the argon2-cffi/RFC 9106 low-memory profile;
+# PINs arrive pre-hashed (SHA256) from the client, and 19 MB single-lane keeps
+# concurrent verifications from each pinning 64 MB and 4 threads
 ph = PasswordHasher(
-    time_cost=2,  # Number of iterations
-    memory_cost=65536,  # 64 MB
-    parallelism=4,  # Number of parallel threads
+    time_cost=3,  # Number of iterations
+    memory_cost=19456,  # 19 MB
+    parallelism=1,  # Number of parallel lanes
     hash_len=32,  # Length of hash in bytes
     salt_len=16  # Length of salt in bytes
 )
 
+# Common PINs not caught by the structural checks below
+_WEAK_PINS = frozenset({'123456', '654321', '123321', '112233'})
+
+# Any ascending/descending run of digits (wrapping 9 -> 0) is a substring of these
+_SEQ_UP = ''.join(str(i % 10) for i in range(20))
+_SEQ_DOWN = _SEQ_UP[::-1]
+
+_b64encode = base64.urlsafe_b64encode
+
+
+@functools.lru_cache(maxsize=16)
+def _needs_rehash_by_params(params: str, salt_b64_len: int, hash_b64_len: int) -> bool:
+    """Rehash decision for one parameter set (salt/digest lengths are part of it)"""
+    return ph.check_needs_rehash(f"{params}${'A' * salt_b64_len}${'A' * hash_b64_len}")
+
+
+def needs_rehash(stored_hash: str) -> bool:
+    """Check whether a stored hash was made with different Argon2 parameters"""
+    params, salt, digest = stored_hash.rsplit("$", 2)
+    return _needs_rehash_by_params(params, len(salt), len(digest))
+
 
 def hash_pin(pin: str) -> str:
     """
@@ -39,6 +64,9 @@ def verify_pin(stored_hash: str, provided_pin: str) -> bool:
     """
     Verify a PIN against its stored hash
     
+    Argon2 verification compares digests in constant time, so timing does
+    not reveal how much of the PIN matched.
+    
     Args:
         stored_hash: The stored Argon2 hash
         provided_pin: The PIN to verify
@@ -50,7 +78,7 @@ def verify_pin(stored_hash: str, provided_pin: str) -> bool:
         ph.verify(stored_hash, provided_pin)
         
         # Check if hash needs rehashing (algorithm updated)
-        if ph.check_needs_rehash(stored_hash):
+        if needs_rehash(stored_hash):
             logger.info("Hash needs rehashing with updated parameters")
         
         return True
@@ -72,7 +100,7 @@ def generate_secure_token(length: int = 32) -> str:
     Returns:
         URL-safe random token
     """
-    return secrets.token_urlsafe(length)
+    return _b64encode(secrets.token_bytes(length)).rstrip(b'=').decode('ascii')
 
 
 def validate_pin_format(pin: str) -> tuple[bool, str]:
@@ -92,24 +120,14 @@ def validate_pin_format(pin: str) -> tuple[bool, str]:
         return False, "PIN must contain only digits"
     
     # Check for weak patterns
-    weak_patterns = [
-        ('123456', '123456 or sequential patterns'),
-        ('654321', '654321 or sequential patterns'),
-        ('000000', 'all same digits'),
-        ('111111', 'all same digits'),
-        ('222222', 'all same digits'),
-        ('333333', 'all same digits'),
-        ('444444', 'all same digits'),
-        ('555555', 'all same digits'),
-        ('666666', 'all same digits'),
-        ('777777', 'all same digits'),
-        ('888888', 'all same digits'),
-        ('999999', 'all same digits'),
-    ]
+    if len(set(pin)) == 1:
+        return False, "PIN is too weak: cannot use all same digits"
+    
+    if pin in _SEQ_UP or pin in _SEQ_DOWN:
+        return False, "PIN is too weak: cannot use 123456 or sequential patterns"
     
-    for pattern, description in weak_patterns:
-        if pin == pattern:
-            return False, f"PIN is too weak: cannot use {description}"
+    if pin in _WEAK_PINS:
+        return False, "PIN is too weak: cannot use a common PIN"
     
     # Check for too few unique digits
     unique_digits = len(set(pin))
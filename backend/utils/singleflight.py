@@ -0,0 +1,31 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+# key -> in-flight call shared by every concurrent caller
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+async def do(key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Run fn once for all concurrent callers using the same key
+    
+    Args:
+        key: Identifies the resource being fetched (e.g. "tx:<id>")
+        fn: Zero-argument coroutine function performing the call
+    
+    Returns:
+        The shared result (or raises the shared exception)
+    """
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(fn())
+        _inflight[key] = future
+        
+        def _forget(done: asyncio.Future):
+            if _inflight.get(key) is done:
+                del _inflight[key]
+        
+        future.add_done_callback(_forget)
+    
+    # Shield so one cancelled caller doesn't cancel the call for the rest
+    return await asyncio.shield(future)
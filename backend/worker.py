@@ -1,53 +1,77 @@
 import asyncio
 import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from temporalio.api.workflowservice.v1 import GetSystemInfoRequest
 from temporalio.client import Client
 from temporalio.worker import Worker
 
 from config import settings
 from workflows.registration import RegistrationWorkflow
 from workflows.payment import PaymentWorkflow
-from activities import twilio_activities, database_activities, circle_activities, pin_activities
+from workflows.results import PaymentResult, RegistrationResult
+from models.database import warm_up_pool, POOL_SIZE
+from activities import twilio_activities, database_activities, circle_activities, pin_activities, db_writer
+from services.circle_service import circle_service
+from cache import redis_client
+import http_clients
+import temporal_client
+from utils.log_queue import setup_queue_logging
 
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, settings.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (records are formatted and written on a background thread)
+setup_queue_logging(getattr(logging, settings.LOG_LEVEL))
 logger = logging.getLogger(__name__)
 
+TEMPORAL_CONNECT_ATTEMPTS = 10
+
+
+async def _warm_up_converter(client: Client) -> None:
+    """Round-trip sample payloads so the first real task doesn't pay the converter's first-use cost"""
+    started = time.perf_counter()
+    converter = client.data_converter
+    samples = [
+        {"x": 1},
+        PaymentResult(success=True, transaction_id="warm-up", amount=1.0),
+        RegistrationResult(success=True, phone_number="warm-up"),
+    ]
+    payloads = await converter.encode(samples)
+    await converter.decode(payloads, [dict, PaymentResult, RegistrationResult])
+    await client.workflow_service.get_system_info(GetSystemInfoRequest())
+    logger.info(f"Payload converter warmed up in {(time.perf_counter() - started) * 1000:.1f} ms")
+
 
 async def main():
     """Start Temporal worker"""
     
-    logger.info("Connecting to Temporal server...")
+    # Blocking work (Argon2 PIN checks, Circle secret encryption) runs via asyncio.to_thread on this pool
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=64))
     
-    # Connect to Temporal with retries
-    max_retries = 10
-    retry_delay = 5
-    client = None
+    logger.info("Connecting to Temporal server...")
     
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"Connection attempt {attempt + 1}/{max_retries}...")
-            client = await Client.connect(settings.TEMPORAL_HOST)
-            logger.info(f"Connected to Temporal at {settings.TEMPORAL_HOST}")
-            break
-        except Exception as e:
-            logger.warning(f"Failed to connect to Temporal: {str(e)}")
-            if attempt < max_retries - 1:
-                logger.info(f"Retrying in {retry_delay} seconds...")
-                await asyncio.sleep(retry_delay)
-            else:
-                logger.error("Could not connect to Temporal after all retries")
-                raise
+    # Connect the shared Temporal client (exponential backoff with jitter);
+    # both workers below run on its single gRPC channel
+    client = await temporal_client.connect_with_backoff(max_attempts=TEMPORAL_CONNECT_ATTEMPTS)
     
-    if not client:
-        raise RuntimeError("Failed to connect to Temporal")
+    # Pre-open database connections before activities start arriving
+    try:
+        await warm_up_pool()
+        logger.info(f"Database pool warmed up ({POOL_SIZE} connections)")
+    except Exception as e:
+        logger.warning(f"Failed to warm up database pool: {str(e)}")
     
-    # Create worker
+    # Workflows and the short messaging/DB/PIN activities share the main queue.
+    # Poll at least once per task-queue partition so no partition sits unpolled
     worker = Worker(
         client,
         task_queue=settings.TEMPORAL_TASK_QUEUE,
+        max_cached_workflows=settings.TEMPORAL_MAX_CACHED_WORKFLOWS,
+        sticky_queue_schedule_to_start_timeout=timedelta(seconds=settings.TEMPORAL_STICKY_QUEUE_TIMEOUT_SECONDS),
+        max_concurrent_activities=settings.TEMPORAL_MAX_CONCURRENT_ACTIVITIES,
+        max_concurrent_workflow_task_polls=max(settings.TEMPORAL_WF_TASK_POLLS, settings.TEMPORAL_PARTITIONS),
+        max_concurrent_activity_task_polls=max(settings.TEMPORAL_ACT_TASK_POLLS, settings.TEMPORAL_PARTITIONS),
+        disable_eager_activity_execution=settings.TEMPORAL_DISABLE_EAGER_ACTIVITY_EXECUTION,
         workflows=[
             RegistrationWorkflow,
             PaymentWorkflow,
@@ -61,6 +85,7 @@ async def main():
             twilio_activities.send_transaction_receipt,
             twilio_activities.send_error_message,
             twilio_activities.send_custom_message,
+            twilio_activities.send_messages_batch,
             
             # Database activities
             database_activities.create_user,
@@ -75,8 +100,17 @@ async def main():
             
             # PIN activities
             pin_activities.verify_user_pin,
-            
-            # Circle activities
+        ],
+    )
+    
+    # Circle calls (including long transfer polls) get their own queue and
+    # slots, so they can't starve the activities above
+    circle_worker = Worker(
+        client,
+        task_queue=settings.TEMPORAL_CIRCLE_TASK_QUEUE,
+        max_concurrent_activities=settings.TEMPORAL_CIRCLE_MAX_CONCURRENT_ACTIVITIES,
+        max_concurrent_activity_task_polls=max(settings.TEMPORAL_ACT_TASK_POLLS, settings.TEMPORAL_PARTITIONS),
+        activities=[
             circle_activities.create_circle_wallet,
             circle_activities.get_wallet_balance,
             circle_activities.initiate_transfer,
@@ -85,12 +119,32 @@ async def main():
         ],
     )
     
-    logger.info(f"Worker started on task queue: {settings.TEMPORAL_TASK_QUEUE}")
+    logger.info(f"Worker started on task queues: {settings.TEMPORAL_TASK_QUEUE}, {settings.TEMPORAL_CIRCLE_TASK_QUEUE}")
     logger.info("Waiting for workflows and activities...")
     
-    # Run worker
-    await worker.run()
+    try:
+        await _warm_up_converter(client)
+    except Exception as e:
+        logger.warning(f"Converter warm-up failed: {str(e)}")
+    
+    try:
+        await circle_service.warm_up()
+    except Exception as e:
+        logger.warning(f"Circle warm-up failed: {str(e)}")
+    
+    # Run workers
+    try:
+        await asyncio.gather(worker.run(), circle_worker.run())
+    finally:
+        await database_activities.flush_message_log()
+        await db_writer.flush()
+        await circle_service.close()
+        await http_clients.close_all()
+        await redis_client.close()
 
 
 if __name__ == "__main__":
+    if sys.platform != "win32":
+        import uvloop
+        uvloop.install()
     asyncio.run(main())
\ No newline at end of file
@@ -1,4 +1,5 @@
 from .registration import RegistrationWorkflow
 from .payment import PaymentWorkflow
+from .results import PaymentResult, RegistrationResult
 
-__all__ = ['RegistrationWorkflow', 'PaymentWorkflow']
\ No newline at end of file
+__all__ = ['RegistrationWorkflow', 'PaymentWorkflow', 'PaymentResult', 'RegistrationResult']
\ No newline at end of file
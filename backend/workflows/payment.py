@@ -1,14 +1,28 @@
 from temporalio import workflow
 from temporalio.common import RetryPolicy
+from temporalio.exceptions import ApplicationError
 from datetime import timedelta, datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+import asyncio
 import logging
 
+from workflows.results import PaymentResult
+
 with workflow.unsafe.imports_passed_through():
     from activities import twilio_activities, database_activities, circle_activities
+    from config import settings
 
 logger = logging.getLogger(__name__)
 
+# Circle calls back off exponentially; permanent failures are not retried
+CIRCLE_RETRY_POLICY = RetryPolicy(
+    initial_interval=timedelta(seconds=1),
+    backoff_coefficient=2.0,
+    maximum_interval=timedelta(seconds=30),
+    maximum_attempts=6,
+    non_retryable_error_types=["TransferDeniedError", "InvalidTokenError"]
+)
+
 
 @workflow.defn
 class PaymentWorkflow:
@@ -25,6 +39,19 @@ class PaymentWorkflow:
     7. Send receipt to user
     """
     
+    # Many payments sit in the worker cache waiting on signals; skip the per-instance __dict__
+    __slots__ = (
+        "phone_number",
+        "amount",
+        "recipient",
+        "recipient_address",
+        "confirmed",
+        "cancelled",
+        "transaction_id",
+        "transfer_id",
+        "transfer_update",
+    )
+    
     def __init__(self):
         self.phone_number: str = ""
         self.amount: float = 0.0
@@ -33,6 +60,8 @@ class PaymentWorkflow:
         self.confirmed: bool = False
         self.cancelled: bool = False
         self.transaction_id: str = ""
+        self.transfer_id: str = ""
+        self.transfer_update: Optional[Dict[str, Any]] = None
     
     @workflow.run
     async def run(
@@ -40,7 +69,7 @@ class PaymentWorkflow:
         phone_number: str,
         amount: float,
         recipient: str
-    ) -> Dict[str, Any]:
+    ) -> PaymentResult:
         """
         Execute payment workflow
         
@@ -58,71 +87,74 @@ class PaymentWorkflow:
         
         workflow.logger.info(f"Starting payment: {phone_number} -> {recipient} ${amount}")
         
-        # Step 1: Get user data
-        user_data = await workflow.execute_activity(
-            database_activities.get_user,
-            phone_number,
-            start_to_close_timeout=timedelta(seconds=10)
-        )
+        # Steps 1-3: Load the sender (user, then balance) while the recipient
+        # resolves; the two chains are independent, so run them concurrently.
+        # Runs started before this change replay the sequential order
+        parallel_load = workflow.patched("parallel-sender-load")
+        if parallel_load:
+            sender, recipient_address = await asyncio.gather(
+                self._load_sender(phone_number),
+                self._resolve_recipient(recipient),
+                return_exceptions=True
+            )
+            
+            if isinstance(sender, BaseException):
+                raise sender
+            user_data, balance = sender
+        else:
+            user_data, balance = await self._load_sender(phone_number)
         
         if not user_data or not user_data["registration_completed"]:
             workflow.logger.error(f"User not registered: {phone_number}")
-            await workflow.execute_activity(
-                twilio_activities.send_error_message,
-                args=[phone_number, "general"],
-                start_to_close_timeout=timedelta(seconds=30)
-            )
-            return {"success": False, "error": "user_not_registered"}
+            await self._send_error("general")
+            return PaymentResult(success=False, error="user_not_registered")
         
         wallet_id = user_data["circle_wallet_id"]
         
-        # Step 2: Check balance
-        balance = await workflow.execute_activity(
-            circle_activities.get_wallet_balance,
-            wallet_id,
-            start_to_close_timeout=timedelta(seconds=30),
-            retry_policy=RetryPolicy(maximum_attempts=3)
-        )
-        
         if balance < amount:
             workflow.logger.warning(f"Insufficient funds for {phone_number}: ${balance} < ${amount}")
-            await workflow.execute_activity(
-                twilio_activities.send_error_message,
-                args=[phone_number, "insufficient_funds"],
-                start_to_close_timeout=timedelta(seconds=30)
-            )
-            return {"success": False, "error": "insufficient_funds"}
+            await self._send_error("insufficient_funds")
+            return PaymentResult(success=False, error="insufficient_funds")
         
-        # Step 3: Resolve recipient address
-        self.recipient_address = await workflow.execute_activity(
-            circle_activities.resolve_recipient_address,
-            recipient,
-            start_to_close_timeout=timedelta(seconds=30),
-            retry_policy=RetryPolicy(maximum_attempts=3)
-        )
+        # Recipient errors surface only once the sender checks have passed
+        if not parallel_load:
+            recipient_address = await self._resolve_recipient(recipient)
+        elif isinstance(recipient_address, BaseException):
+            raise recipient_address
+        self.recipient_address = recipient_address
         
-        # Step 4: Create transaction record
-        self.transaction_id = await workflow.execute_activity(
-            database_activities.create_transaction,
-            args=[phone_number, "send", amount, recipient, self.recipient_address],
-            start_to_close_timeout=timedelta(seconds=10)
-        )
-        
-        # Step 5: Request confirmation
-        await workflow.execute_activity(
-            twilio_activities.send_confirmation_request,
-            args=[phone_number, "send", amount, recipient],
-            start_to_close_timeout=timedelta(seconds=30),
-            retry_policy=RetryPolicy(maximum_attempts=3)
-        )
+        # Steps 4-5: Create the transaction record (local activity) while the
+        # confirmation prompt goes out; the prompt doesn't need the record.
+        # Runs started before this change replay the two regular activities in turn
+        if workflow.patched("local-create-transaction"):
+            self.transaction_id, _ = await asyncio.gather(
+                workflow.execute_local_activity(
+                    database_activities.create_transaction,
+                    args=[phone_number, "send", amount, recipient, self.recipient_address],
+                    start_to_close_timeout=timedelta(seconds=10)
+                ),
+                self._request_confirmation()
+            )
+        else:
+            self.transaction_id = await workflow.execute_activity(
+                database_activities.create_transaction,
+                args=[phone_number, "send", amount, recipient, self.recipient_address],
+                start_to_close_timeout=timedelta(seconds=10)
+            )
+            await self._request_confirmation()
         
         # Step 6: Wait for confirmation (2 minutes timeout)
         workflow.logger.info(f"Waiting for payment confirmation from {phone_number}")
         
-        await workflow.wait_condition(
-            lambda: self.confirmed or self.cancelled,
-            timeout=timedelta(minutes=2)
-        )
+        # One durable timer; the condition is only rechecked when a signal arrives.
+        # wait_condition raises on timeout, which falls through to the timeout branch
+        try:
+            await workflow.wait_condition(
+                lambda: self.confirmed or self.cancelled,
+                timeout=timedelta(minutes=2)
+            )
+        except asyncio.TimeoutError:
+            pass
         
         if self.cancelled:
             workflow.logger.info(f"Payment cancelled by user: {phone_number}")
@@ -137,7 +169,7 @@ class PaymentWorkflow:
                 args=[phone_number, "❌ Payment cancelled."],
                 start_to_close_timeout=timedelta(seconds=30)
             )
-            return {"success": False, "error": "cancelled_by_user"}
+            return PaymentResult(success=False, error="cancelled_by_user")
         
         if not self.confirmed:
             workflow.logger.warning(f"Confirmation timeout for {phone_number}")
@@ -146,54 +178,153 @@ class PaymentWorkflow:
                 args=[self.transaction_id, "timeout", None],
                 start_to_close_timeout=timedelta(seconds=10)
             )
-            return {"success": False, "error": "confirmation_timeout"}
+            return PaymentResult(success=False, error="confirmation_timeout")
         
         # Step 7: Execute transfer
         workflow.logger.info(f"Executing transfer for {phone_number}")
         
         transfer_result = await workflow.execute_activity(
             circle_activities.initiate_transfer,
-            args=[wallet_id, self.recipient_address, amount],
+            args=[wallet_id, self.recipient_address, amount, user_data.get("circle_usdc_token_id")],
+            task_queue=settings.TEMPORAL_CIRCLE_TASK_QUEUE,
             start_to_close_timeout=timedelta(seconds=60),
-            retry_policy=RetryPolicy(maximum_attempts=3)
+            retry_policy=CIRCLE_RETRY_POLICY
         )
         
-        # Step 8: Check transfer status and wait for tx_hash
-        transfer_status = await workflow.execute_activity(
+        # Step 8: Wait for tx_hash (Circle webhook signal, polling as fallback).
+        # The poll holds off briefly before its first request, so with a webhook
+        # subscription most transfers settle without polling at all
+        self.transfer_id = transfer_result["transfer_id"]
+        status_poll = workflow.start_activity(
             circle_activities.check_transfer_status,
-            transfer_result["transfer_id"],
+            self.transfer_id,
+            task_queue=settings.TEMPORAL_CIRCLE_TASK_QUEUE,
             start_to_close_timeout=timedelta(minutes=4),
-            retry_policy=RetryPolicy(maximum_attempts=3)
+            heartbeat_timeout=timedelta(seconds=30),
+            retry_policy=CIRCLE_RETRY_POLICY
         )
         
-        tx_hash = transfer_status.get("tx_hash", "")
+        await workflow.wait_condition(
+            lambda: self._transfer_settled() or status_poll.done()
+        )
+        
+        if self._transfer_settled():
+            status_poll.cancel()
+            
+            if not self.transfer_update.get("tx_hash"):
+                raise ApplicationError(f"Transfer failed with status: {self.transfer_update.get('state')}")
+            
+            tx_hash = self.transfer_update["tx_hash"]
+        else:
+            transfer_status = await status_poll
+            tx_hash = transfer_status.get("tx_hash", "")
+        
+        # Steps 9-10: Record the tx_hash and send the receipt (independent, so concurrently)
+        timestamp = workflow.now().replace(microsecond=0, tzinfo=None).isoformat(" ") + " UTC"
         
-        # Step 9: Update transaction with tx_hash
+        # Runs started before this change replay them one after the other
+        if workflow.patched("parallel-completion"):
+            await asyncio.gather(self._record_tx_hash(tx_hash), self._send_receipt(tx_hash, timestamp))
+        else:
+            await self._record_tx_hash(tx_hash)
+            await self._send_receipt(tx_hash, timestamp)
+        
+        workflow.logger.info(f"Payment completed: {tx_hash}")
+        
+        return PaymentResult(
+            success=True,
+            transaction_id=self.transaction_id,
+            tx_hash=tx_hash,
+            amount=amount,
+            recipient=recipient
+        )
+    
+    async def _send_error(self, error_type: str):
+        """Tell the user the payment can't go ahead (local activity: no task-queue round-trip)"""
+        # Runs started before the switch recorded a regular activity here
+        if not workflow.patched("local-error-message"):
+            await workflow.execute_activity(
+                twilio_activities.send_error_message,
+                args=[self.phone_number, error_type],
+                start_to_close_timeout=timedelta(seconds=30)
+            )
+            return
+        
+        await workflow.execute_local_activity(
+            twilio_activities.send_error_message,
+            args=[self.phone_number, error_type],
+            start_to_close_timeout=timedelta(seconds=30)
+        )
+    
+    async def _load_sender(self, phone_number: str) -> Tuple[Optional[Dict[str, Any]], float]:
+        """Get the sender's user record and, if registered, their wallet balance"""
+        user_data = await workflow.execute_activity(
+            database_activities.get_user,
+            phone_number,
+            start_to_close_timeout=timedelta(seconds=10)
+        )
+        
+        if not user_data or not user_data["registration_completed"]:
+            return user_data, 0.0
+        
+        balance = await workflow.execute_activity(
+            circle_activities.get_wallet_balance,
+            user_data["circle_wallet_id"],
+            task_queue=settings.TEMPORAL_CIRCLE_TASK_QUEUE,
+            start_to_close_timeout=timedelta(seconds=30),
+            retry_policy=RetryPolicy(maximum_attempts=3)
+        )
+        return user_data, balance
+    
+    async def _request_confirmation(self) -> None:
+        """Ask the sender to confirm the payment"""
+        await workflow.execute_activity(
+            twilio_activities.send_confirmation_request,
+            args=[self.phone_number, "send", self.amount, self.recipient],
+            start_to_close_timeout=timedelta(seconds=30),
+            retry_policy=RetryPolicy(maximum_attempts=3)
+        )
+    
+    async def _record_tx_hash(self, tx_hash: str) -> None:
+        """Mark the transaction confirmed with its on-chain hash"""
         await workflow.execute_activity(
             database_activities.update_transaction_status,
             args=[self.transaction_id, "confirmed", tx_hash],
             start_to_close_timeout=timedelta(seconds=10)
         )
-        
-        # Step 10: Send receipt
-        timestamp = workflow.now().strftime("%Y-%m-%d %H:%M:%S UTC")
-        
+    
+    async def _send_receipt(self, tx_hash: str, timestamp: str) -> None:
+        """Send the sender their receipt"""
         await workflow.execute_activity(
             twilio_activities.send_transaction_receipt,
-            args=[phone_number, amount, recipient, tx_hash, timestamp],
+            args=[self.phone_number, self.amount, self.recipient, tx_hash, timestamp],
             start_to_close_timeout=timedelta(seconds=30),
             retry_policy=RetryPolicy(maximum_attempts=3)
         )
-        
-        workflow.logger.info(f"Payment completed: {tx_hash}")
-        
-        return {
-            "success": True,
-            "transaction_id": self.transaction_id,
-            "tx_hash": tx_hash,
-            "amount": amount,
-            "recipient": recipient
-        }
+    
+    async def _resolve_recipient(self, recipient: str) -> str:
+        """Resolve a name/phone/address to the recipient's wallet address"""
+        return await workflow.execute_activity(
+            circle_activities.resolve_recipient_address,
+            recipient,
+            task_queue=settings.TEMPORAL_CIRCLE_TASK_QUEUE,
+            start_to_close_timeout=timedelta(seconds=30),
+            retry_policy=RetryPolicy(maximum_attempts=3)
+        )
+    
+    def _transfer_settled(self) -> bool:
+        """Whether the webhook reported a final state for our transfer"""
+        return (
+            self.transfer_update is not None
+            and self.transfer_update.get("transfer_id") == self.transfer_id
+        )
+    
+    @workflow.signal
+    async def transfer_completed(self, update: Dict[str, Any]):
+        """Signal from the Circle webhook with the transfer's final state"""
+        workflow.logger.info(f"Transfer update received: {update}")
+        if update.get("tx_hash") or update.get("state") in ("FAILED", "DENIED"):
+            self.transfer_update = update
     
     @workflow.signal
     async def confirm_payment(self):
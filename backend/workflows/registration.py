@@ -1,15 +1,44 @@
 from temporalio import workflow
 from temporalio.common import RetryPolicy
 from datetime import timedelta
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+import asyncio
+import base64
+import binascii
+import hmac
 import logging
+import uuid
+
+from workflows.results import RegistrationResult
 
 # Import activities
 with workflow.unsafe.imports_passed_through():
     from activities import twilio_activities, database_activities, circle_activities
+    from config import settings
 
 logger = logging.getLogger(__name__)
 
+# Manual verification: how long to wait for the code, and how many tries
+VERIFICATION_TIMEOUT = timedelta(minutes=10)
+VERIFICATION_MAX_ATTEMPTS = 3
+
+
+# Links sent before tokens were shortened carry the canonical UUID string.
+# They expire with their workflow's 15 minute PIN wait, so this can go one
+# release after the change
+LEGACY_TOKEN_LENGTH = 36
+
+
+def _decode_token(token: Optional[str]) -> bytes:
+    """Decode a PIN setup token from its URL form (unpadded URL-safe base64, or a legacy UUID string)"""
+    token = token or ""
+    try:
+        if len(token) == LEGACY_TOKEN_LENGTH:
+            return uuid.UUID(token).bytes
+        return base64.urlsafe_b64decode(token + "==")
+    except (binascii.Error, ValueError):
+        return b""
+
 
 @workflow.defn
 class RegistrationWorkflow:
@@ -18,7 +47,7 @@ class RegistrationWorkflow:
     
     Steps:
     1. Create user in database
-    2. Auto-verify user (skip manual code entry)
+    2. Verify user (auto-verify, or via the WhatsApp code when skip_verification is False)
     3. Generate PIN setup token
     4. Send PIN setup link
     5. Wait for PIN setup (via signal)
@@ -27,20 +56,32 @@ class RegistrationWorkflow:
     8. Send welcome message
     """
     
+    # Registrations wait up to 15 minutes in the worker cache; skip the per-instance __dict__
+    __slots__ = (
+        "phone_number",
+        "code_verified",
+        "submitted_code",
+        "pin_setup_token",
+        "pin_set",
+        "wallet_created",
+    )
+    
     def __init__(self):
         self.phone_number: str = ""
         self.code_verified: bool = False
-        self.pin_setup_token: str = ""
+        self.submitted_code: Optional[str] = None
+        self.pin_setup_token: bytes = b""
         self.pin_set: bool = False
         self.wallet_created: bool = False
     
     @workflow.run
-    async def run(self, phone_number: str) -> Dict[str, Any]:
+    async def run(self, phone_number: str, skip_verification: bool = True) -> RegistrationResult:
         """
         Execute registration workflow
         
         Args:
             phone_number: User's WhatsApp number
+            skip_verification: Auto-verify instead of sending a code and waiting for verify_code
         
         Returns:
             Registration result with user data
@@ -57,31 +98,32 @@ class RegistrationWorkflow:
             retry_policy=RetryPolicy(maximum_attempts=3)
         )
         
-        # Step 2: Auto-verify user (skip manual code entry)
-        verified = await workflow.execute_activity(
-            database_activities.auto_verify_user,
-            phone_number,
-            start_to_close_timeout=timedelta(seconds=10)
-        )
+        # Step 2: Verify user
+        if skip_verification:
+            verified = await workflow.execute_activity(
+                database_activities.auto_verify_user,
+                phone_number,
+                start_to_close_timeout=timedelta(seconds=10)
+            )
+        else:
+            verified = await self._verify_with_code(user_data.get("verification_code"))
         
         if not verified:
-            workflow.logger.error(f"Auto-verification failed for {phone_number}")
-            await workflow.execute_activity(
-                twilio_activities.send_error_message,
-                args=[phone_number, "general"],
-                start_to_close_timeout=timedelta(seconds=30)
-            )
-            return {"success": False, "error": "verification_failed"}
+            workflow.logger.error(f"Verification failed for {phone_number}")
+            await self._send_error()
+            return RegistrationResult(success=False, error="verification_failed")
         
         self.code_verified = True
         
         # Step 3: Generate PIN setup token (using workflow.uuid4 for determinism)
-        self.pin_setup_token = str(workflow.uuid4())
+        # Kept as the raw 16 bytes; the link carries it as unpadded URL-safe base64
+        self.pin_setup_token = workflow.uuid4().bytes
+        setup_token = base64.urlsafe_b64encode(self.pin_setup_token).rstrip(b"=").decode("ascii")
         
         # Step 4: Send PIN setup link
         await workflow.execute_activity(
             twilio_activities.send_pin_setup_link,
-            args=[phone_number, self.pin_setup_token],
+            args=[phone_number, setup_token],
             start_to_close_timeout=timedelta(seconds=30),
             retry_policy=RetryPolicy(maximum_attempts=3)
         )
@@ -89,58 +131,125 @@ class RegistrationWorkflow:
         # Step 5: Wait for PIN setup (signal or timeout after 15 minutes)
         workflow.logger.info(f"Waiting for PIN setup from {phone_number}")
         
-        await workflow.wait_condition(
-            lambda: self.pin_set,
-            timeout=timedelta(minutes=15)
-        )
+        try:
+            await workflow.wait_condition(
+                lambda: self.pin_set,
+                timeout=timedelta(minutes=15)
+            )
+        except asyncio.TimeoutError:
+            pass
         
         if not self.pin_set:
             workflow.logger.warning(f"PIN setup timeout for {phone_number}")
-            await workflow.execute_activity(
-                twilio_activities.send_error_message,
-                args=[phone_number, "general"],
-                start_to_close_timeout=timedelta(seconds=30)
-            )
-            return {"success": False, "error": "pin_setup_timeout"}
+            await self._send_error()
+            return RegistrationResult(success=False, error="pin_setup_timeout")
         
         # Step 6: Create Circle wallet
         wallet_data = await workflow.execute_activity(
             circle_activities.create_circle_wallet,
             phone_number,
+            task_queue=settings.TEMPORAL_CIRCLE_TASK_QUEUE,
             start_to_close_timeout=timedelta(seconds=60),
             retry_policy=RetryPolicy(maximum_attempts=3)
         )
         
-        # Step 7: Update user with wallet info
+        # Steps 7-8: Save the wallet and welcome the user (independent, so concurrently).
+        # Runs started before this change replay them one after the other
+        if workflow.patched("parallel-completion"):
+            await asyncio.gather(self._save_wallet(wallet_data), self._send_welcome())
+        else:
+            await self._save_wallet(wallet_data)
+            await self._send_welcome()
+        
+        self.wallet_created = True
+        
+        workflow.logger.info(f"Registration completed for {phone_number}")
+        
+        return RegistrationResult(
+            success=True,
+            phone_number=phone_number,
+            wallet_id=wallet_data["wallet_id"],
+            wallet_address=wallet_data["wallet_address"]
+        )
+    
+    async def _save_wallet(self, wallet_data: Dict[str, Any]) -> None:
+        """Store the new wallet on the user record"""
         await workflow.execute_activity(
             database_activities.update_user_wallet,
             args=[
-                phone_number,
+                self.phone_number,
                 wallet_data["wallet_id"],
-                wallet_data["wallet_address"]
+                wallet_data["wallet_address"],
+                wallet_data.get("usdc_token_id")
             ],
             start_to_close_timeout=timedelta(seconds=10),
             retry_policy=RetryPolicy(maximum_attempts=3)
         )
+    
+    async def _send_welcome(self) -> None:
+        """Welcome the user once their wallet exists"""
+        await workflow.execute_activity(
+            twilio_activities.send_welcome_message,
+            args=[self.phone_number, None],
+            start_to_close_timeout=timedelta(seconds=30),
+            retry_policy=RetryPolicy(maximum_attempts=3)
+        )
+    
+    async def _send_error(self, error_type: str = "general"):
+        """Tell the user registration hit a problem (local activity: no task-queue round-trip)"""
+        # Runs started before the switch recorded a regular activity here
+        if not workflow.patched("local-error-message"):
+            await workflow.execute_activity(
+                twilio_activities.send_error_message,
+                args=[self.phone_number, error_type],
+                start_to_close_timeout=timedelta(seconds=30)
+            )
+            return
         
-        self.wallet_created = True
+        await workflow.execute_local_activity(
+            twilio_activities.send_error_message,
+            args=[self.phone_number, error_type],
+            start_to_close_timeout=timedelta(seconds=30)
+        )
+    
+    async def _verify_with_code(self, verification_code: Optional[str]) -> bool:
+        """Send the verification code and wait for the user to submit it"""
+        if not verification_code:
+            return False
         
-        # Step 8: Send welcome message
         await workflow.execute_activity(
-            twilio_activities.send_welcome_message,
-            args=[phone_number, None],
+            twilio_activities.send_verification_code,
+            args=[self.phone_number, verification_code],
             start_to_close_timeout=timedelta(seconds=30),
             retry_policy=RetryPolicy(maximum_attempts=3)
         )
         
-        workflow.logger.info(f"Registration completed for {phone_number}")
+        for _ in range(VERIFICATION_MAX_ATTEMPTS):
+            try:
+                await workflow.wait_condition(
+                    lambda: self.submitted_code is not None,
+                    timeout=VERIFICATION_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                workflow.logger.warning(f"Verification code timeout for {self.phone_number}")
+                return False
+            
+            code, self.submitted_code = self.submitted_code, None
+            verified = await workflow.execute_activity(
+                database_activities.verify_user_code,
+                args=[self.phone_number, code],
+                start_to_close_timeout=timedelta(seconds=10)
+            )
+            if verified:
+                return True
         
-        return {
-            "success": True,
-            "phone_number": phone_number,
-            "wallet_id": wallet_data["wallet_id"],
-            "wallet_address": wallet_data["wallet_address"]
-        }
+        return False
+    
+    @workflow.signal
+    async def verify_code(self, code: str):
+        """Signal with the verification code the user replied with"""
+        workflow.logger.info(f"Received verification code for {self.phone_number}")
+        self.submitted_code = code
     
     @workflow.signal
     async def set_pin(self, args: dict):
@@ -150,8 +259,8 @@ class RegistrationWorkflow:
         pin_hash = args.get("pin_hash")
         token = args.get("token")
         
-        # Verify token matches
-        if token != self.pin_setup_token:
+        # Verify token matches (constant-time)
+        if not self.pin_setup_token or not hmac.compare_digest(_decode_token(token), self.pin_setup_token):
             workflow.logger.warning("Invalid PIN setup token")
             return
         
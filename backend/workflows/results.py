@@ -0,0 +1,23 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(slots=True, frozen=True)
+class PaymentResult:
+    """Outcome of a PaymentWorkflow run"""
+    success: bool
+    error: Optional[str] = None
+    transaction_id: Optional[str] = None
+    tx_hash: Optional[str] = None
+    amount: Optional[float] = None
+    recipient: Optional[str] = None
+
+
+@dataclass(slots=True, frozen=True)
+class RegistrationResult:
+    """Outcome of a RegistrationWorkflow run"""
+    success: bool
+    error: Optional[str] = None
+    phone_number: Optional[str] = None
+    wallet_id: Optional[str] = None
+    wallet_address: Optional[str] = None
\ No newline at end of file
@@ -10,6 +10,24 @@ type Env = {
 
 const app = new Hono<{ Bindings: Env }>();
 
+// Empty TwiML reply (replies are sent through the backend API), built once
+const EMPTY_TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response></Response>';
+const TWIML_HEADERS = { 'Content-Type': 'text/xml' };
+
+// The backend rejects history requests for more than this many transactions
+const MAX_TRANSACTION_HISTORY = 100;
+
+// Canonical one-word commands, handled without asking the model for the intent
+const QUICK_COMMANDS: Record<string, 'checkBalance' | 'confirmAction' | 'cancelAction'> = {
+	balance: 'checkBalance',
+	confirm: 'confirmAction',
+	yes: 'confirmAction',
+	y: 'confirmAction',
+	cancel: 'cancelAction',
+	no: 'cancelAction',
+	n: 'cancelAction',
+};
+
 app.use('/*', cors());
 
 // In-memory storage for user context (workflow IDs, etc.)
@@ -44,6 +62,73 @@ async function runAIWithRetry(
 	throw lastError;
 }
 
+// Deliver the assistant's reply (voice replies fall back to text)
+async function deliverReply(env: Env, phoneNumber: string, responseText: string, isAudioInput: boolean) {
+	if (isAudioInput) {
+		// Generate and send audio response
+		try {
+			const ttsResponse = await fetch(`${env.BACKEND_API_URL}/api/generate-speech`, {
+				method: 'POST',
+				headers: {
+					'Content-Type': 'application/json',
+					'X-API-Key': env.BACKEND_API_KEY,
+				},
+				body: JSON.stringify({
+					text: responseText,
+					to: phoneNumber,
+					// The backend sends the text while it renders the voice note
+					include_text: true,
+				}),
+			});
+
+			const ttsResult = await ttsResponse.json();
+			
+			if (!ttsResult.success && !ttsResult.text_message_sid) {
+				console.error('TTS failed, sending text instead:', ttsResult.error);
+				// Fallback to text message
+				await fetch(`${env.BACKEND_API_URL}/api/send-message`, {
+					method: 'POST',
+					headers: {
+						'Content-Type': 'application/json',
+						'X-API-Key': env.BACKEND_API_KEY,
+					},
+					body: JSON.stringify({
+						to: phoneNumber,
+						message: responseText,
+					}),
+				});
+			}
+		} catch (error) {
+			console.error('TTS error, sending text instead:', error);
+			// Fallback to text message
+			await fetch(`${env.BACKEND_API_URL}/api/send-message`, {
+				method: 'POST',
+				headers: {
+					'Content-Type': 'application/json',
+					'X-API-Key': env.BACKEND_API_KEY,
+				},
+				body: JSON.stringify({
+					to: phoneNumber,
+					message: responseText,
+				}),
+			});
+		}
+	} else {
+		// Send text response
+		await fetch(`${env.BACKEND_API_URL}/api/send-message`, {
+			method: 'POST',
+			headers: {
+				'Content-Type': 'application/json',
+				'X-API-Key': env.BACKEND_API_KEY,
+			},
+			body: JSON.stringify({
+				to: phoneNumber,
+				message: responseText,
+			}),
+		});
+	}
+}
+
 // Tool implementations - these call your FastAPI backend
 async function registerUser(env: Env, phoneNumber: string) {
 	console.log('Calling backend:', `${env.BACKEND_API_URL}/api/register`);
@@ -102,6 +187,7 @@ async function checkBalance(env: Env, phoneNumber: string) {
 }
 
 async function getTransactionHistory(env: Env, phoneNumber: string, limit: number = 10) {
+	limit = Math.min(Math.max(Math.floor(limit), 1), MAX_TRANSACTION_HISTORY);
 	const response = await fetch(
 		`${env.BACKEND_API_URL}/api/transactions/${encodeURIComponent(phoneNumber)}?limit=${limit}`,
 		{
@@ -205,9 +291,7 @@ app.post('/webhook/whatsapp', async (c) => {
 						}),
 					});
 					
-					return c.text('<?xml version="1.0" encoding="UTF-8"?><Response></Response>', 200, {
-						'Content-Type': 'text/xml',
-					});
+					return c.text(EMPTY_TWIML, 200, TWIML_HEADERS);
 				}
 			} catch (error) {
 				console.error('Transcription error:', error);
@@ -223,22 +307,44 @@ app.post('/webhook/whatsapp', async (c) => {
 					}),
 				});
 				
-				return c.text('<?xml version="1.0" encoding="UTF-8"?><Response></Response>', 200, {
-					'Content-Type': 'text/xml',
-				});
+				return c.text(EMPTY_TWIML, 200, TWIML_HEADERS);
 			}
 		}
 		
 		// Skip processing if no message text
 		if (!messageText || messageText.trim() === '') {
-			return c.text('<?xml version="1.0" encoding="UTF-8"?><Response></Response>', 200, {
-				'Content-Type': 'text/xml',
-			});
+			return c.text(EMPTY_TWIML, 200, TWIML_HEADERS);
 		}
 
 		// Get user context
 		let context = userContext.get(phoneNumber) || {};
 
+		// Quick commands skip the AI round-trip; confirm/cancel only with a payment pending
+		const quickCommand = QUICK_COMMANDS[messageText.trim().toLowerCase()];
+		if (quickCommand === 'checkBalance') {
+			const balanceResult = await checkBalance(c.env, phoneNumber);
+			const balanceText = balanceResult.message || 'I encountered an issue processing your request.';
+			c.executionCtx.waitUntil(
+				deliverReply(c.env, phoneNumber, balanceText, isAudioInput).catch((error) =>
+					console.error('Reply delivery error:', error)
+				)
+			);
+			return c.text(EMPTY_TWIML, 200, TWIML_HEADERS);
+		}
+		if (quickCommand && context.lastWorkflowId && context.lastWorkflowType === 'payment') {
+			const actionResult =
+				quickCommand === 'confirmAction'
+					? await confirmAction(c.env, phoneNumber, context.lastWorkflowId)
+					: await cancelAction(c.env, phoneNumber, context.lastWorkflowId);
+			console.log({ tool: quickCommand, response: actionResult });
+
+			// Clear context; the backend sends the receipt or cancellation message
+			context.lastWorkflowId = undefined;
+			context.lastWorkflowType = undefined;
+			userContext.set(phoneNumber, context);
+			return c.text(EMPTY_TWIML, 200, TWIML_HEADERS);
+		}
+
 		// Build conversation messages
 		const messages: any[] = [
 			{
@@ -336,7 +442,7 @@ Be helpful and concise. Don't explain your tool calls to the user.`,
 					properties: {
 						limit: {
 							type: 'number',
-							description: 'Number of transactions to retrieve (default 10)',
+							description: 'Number of transactions to retrieve (default 10, max 100)',
 						},
 					},
 					required: [],
@@ -395,9 +501,7 @@ Be helpful and concise. Don't explain your tool calls to the user.`,
 				}),
 			});
 			
-			return c.text('<?xml version="1.0" encoding="UTF-8"?><Response></Response>', 200, {
-				'Content-Type': 'text/xml',
-			});
+			return c.text(EMPTY_TWIML, 200, TWIML_HEADERS);
 		}
 
 		// Process tool calls - only process ONCE
@@ -503,9 +607,7 @@ Be helpful and concise. Don't explain your tool calls to the user.`,
 
 			// If backend already sent a message, don't send AI response
 			if (skipAIResponse) {
-				return c.text('<?xml version="1.0" encoding="UTF-8"?><Response></Response>', 200, {
-					'Content-Type': 'text/xml',
-				});
+				return c.text(EMPTY_TWIML, 200, TWIML_HEADERS);
 			}
 
 			// Add tool response to messages
@@ -536,87 +638,25 @@ Be helpful and concise. Don't explain your tool calls to the user.`,
 					}),
 				});
 				
-				return c.text('<?xml version="1.0" encoding="UTF-8"?><Response></Response>', 200, {
-					'Content-Type': 'text/xml',
-				});
+				return c.text(EMPTY_TWIML, 200, TWIML_HEADERS);
 			}
 		}
 
 		// Get final assistant message
 		let responseText = result.response || 'I encountered an issue processing your request.';
 
-		// Send response back to user
-		if (isAudioInput) {
-			// Generate and send audio response
-			try {
-				const ttsResponse = await fetch(`${c.env.BACKEND_API_URL}/api/generate-speech`, {
-					method: 'POST',
-					headers: {
-						'Content-Type': 'application/json',
-						'X-API-Key': c.env.BACKEND_API_KEY,
-					},
-					body: JSON.stringify({
-						text: responseText,
-						to: phoneNumber,
-					}),
-				});
-
-				const ttsResult = await ttsResponse.json();
-				
-				if (!ttsResult.success) {
-					console.error('TTS failed, sending text instead:', ttsResult.error);
-					// Fallback to text message
-					await fetch(`${c.env.BACKEND_API_URL}/api/send-message`, {
-						method: 'POST',
-						headers: {
-							'Content-Type': 'application/json',
-							'X-API-Key': c.env.BACKEND_API_KEY,
-						},
-						body: JSON.stringify({
-							to: phoneNumber,
-							message: responseText,
-						}),
-					});
-				}
-			} catch (error) {
-				console.error('TTS error, sending text instead:', error);
-				// Fallback to text message
-				await fetch(`${c.env.BACKEND_API_URL}/api/send-message`, {
-					method: 'POST',
-					headers: {
-						'Content-Type': 'application/json',
-						'X-API-Key': c.env.BACKEND_API_KEY,
-					},
-					body: JSON.stringify({
-						to: phoneNumber,
-						message: responseText,
-					}),
-				});
-			}
-		} else {
-			// Send text response
-			await fetch(`${c.env.BACKEND_API_URL}/api/send-message`, {
-				method: 'POST',
-				headers: {
-					'Content-Type': 'application/json',
-					'X-API-Key': c.env.BACKEND_API_KEY,
-				},
-				body: JSON.stringify({
-					to: phoneNumber,
-					message: responseText,
-				}),
-			});
-		}
+		// Reply after Twilio has its TwiML; waitUntil keeps the worker alive until it's sent
+		c.executionCtx.waitUntil(
+			deliverReply(c.env, phoneNumber, responseText, isAudioInput).catch((error) =>
+				console.error('Reply delivery error:', error)
+			)
+		);
 
 		// Return TwiML response (empty since we're sending via API)
-		return c.text('<?xml version="1.0" encoding="UTF-8"?><Response></Response>', 200, {
-			'Content-Type': 'text/xml',
-		});
+		return c.text(EMPTY_TWIML, 200, TWIML_HEADERS);
 	} catch (error) {
 		console.error('Webhook error:', error);
-		return c.text('<?xml version="1.0" encoding="UTF-8"?><Response></Response>', 200, {
-			'Content-Type': 'text/xml',
-		});
+		return c.text(EMPTY_TWIML, 200, TWIML_HEADERS);
 	}
 });
 